@@ -4,43 +4,255 @@ Analyzes emerging business trends across various sectors using AI
 Team: Abdul Hannan, Agha Ahsan, Minahil Asif
 """
 
-from flask import Flask, request, jsonify
+import time
+STARTUP_STARTED = time.perf_counter()  # Module import start, reported by --profile-startup
+
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
+import sys
+import argparse
 import json
 import logging
+import logging.handlers
+import random
+import re
 from datetime import datetime
-from collections import deque
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+import threading
+import queue
+import sqlite3
+import atexit
+import asyncio
+import bisect
+import heapq
+import gzip
+import shutil
 import uuid
+from urllib.parse import parse_qs, urlsplit
+import math
+import hashlib
+import ipaddress
+import socket
+import importlib.util
+import subprocess
+from contextlib import contextmanager, asynccontextmanager
+
+# Startup phases (name, perf_counter at phase end) for --profile-startup
+STARTUP_PHASES = []
+
+def mark_startup(phase):
+    """Record the end of a startup phase"""
+    STARTUP_PHASES.append((phase, time.perf_counter()))
 
 # Load environment variables from .env file
+# python-dotenv is only imported when there is a file to load
+ENV_FILE = next((path for path in (os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'), '.env')
+                 if os.path.isfile(path)), None)
+if ENV_FILE:
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(ENV_FILE)
+    except ImportError:
+        pass  # dotenv not required, can use system env vars
+
+# Google Generative AI - optional (fallback mode if not available)
+# Imported on first use by configure_gemini, the SDK is slow to import
+
+# orjson - optional (stdlib json if not available)
 try:
-    from dotenv import load_dotenv
-    load_dotenv()
+    import orjson
 except ImportError:
-    pass  # dotenv not required, can use system env vars
+    orjson = None
 
-# Google Generative AI - optional (fallback mode if not available)
+# File locks for long-term log segments - fcntl on POSIX, msvcrt on Windows
 try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
+    import fcntl
+    msvcrt = None
 except ImportError:
-    genai = None
-    GEMINI_AVAILABLE = False
+    fcntl = None
+    import msvcrt
+
+mark_startup('imports')
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('agent.log'),
-        logging.StreamHandler()
-    ]
-)
+# Records go through a queue to a background writer thread, so requests never
+# wait on disk. High-frequency routes can be sampled (LOG_SAMPLE_RATES).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('LOG_FILE', 'agent.log')  # Empty disables the log file; forked workers write agent.<pid>.log
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()  # json or text
+LOG_ROTATION = os.environ.get('LOG_ROTATION', 'size').lower()  # size or time
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', 'midnight')
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '/health=0.01,/info=0.1')  # route=rate pairs
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log record"""
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName
+        }
+        for field in ('route', 'sample_rate'):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RouteSamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO/DEBUG records for configured routes
+
+    The route comes from extra={'route': ...} or, for werkzeug access logs,
+    from the request line. Warnings and errors are never dropped.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        route = getattr(record, 'route', None)
+        if route is None and record.name == 'werkzeug' and record.args:
+            request_line = str(record.args[0]).split()
+            route = request_line[1].split('?')[0] if len(request_line) > 1 else None
+        rate = self.rates.get(route)
+        if rate is None:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+def parse_sample_rates(spec):
+    """Parse '/health=0.01,/info=0.1' into a dict"""
+    rates = {}
+    for pair in spec.split(','):
+        route, _, rate = pair.strip().partition('=')
+        if route and rate:
+            try:
+                rates[route] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                pass
+    return rates
+
+def log_file_handler(path, formatter):
+    """Rotating handler for one log file"""
+    if LOG_ROTATION == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    handler.setFormatter(formatter)
+    return handler
+
+def worker_log_file(path, pid):
+    """Per-process log file name, agent.log -> agent.<pid>.log"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{pid}{ext or '.log'}"
+
+def configure_logging():
+    """Set up queue-based logging, returns the started QueueListener"""
+    if LOG_FORMAT == 'json':
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    handlers = [console]
+    if LOG_FILE:
+        handlers.append(log_file_handler(LOG_FILE, formatter))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RouteSamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    def restart_in_child():
+        # Forked workers (gunicorn preload_app) inherit the queue but not the writer
+        # thread. The inherited queue's lock may have been held by that thread at
+        # fork time, so the child starts over with a fresh queue and listener.
+        # Each worker rotating the shared file would clobber the others' logs,
+        # so it writes (and rotates) a file of its own
+        global log_listener
+        atexit.unregister(log_listener.stop)
+        child_handlers = [console]
+        if LOG_FILE:
+            handlers[1].close()
+            child_handlers.append(log_file_handler(worker_log_file(LOG_FILE, os.getpid()), formatter))
+        child_queue = queue.SimpleQueue()
+        queue_handler.queue = child_queue
+        log_listener = logging.handlers.QueueListener(child_queue, *child_handlers, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+    
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=restart_in_child)
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
+mark_startup('logging')
 
 # Initialize Flask app
+# Fast JSON
+def dumps_json(obj):
+    """Serialize to UTF-8 JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str).encode('utf-8')
+
+def loads_json(data):
+    """Parse JSON text or bytes, with orjson when available (raises ValueError)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, same output rules as the default
+
+    Keys stay sorted and datetimes still go through Flask's default
+    handler. Calls with extra json.dumps options use the stdlib path.
+    """
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _dumps_bytes(self, obj):
+        return orjson.dumps(
+            obj, default=self.default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # Configure CORS - Allow all origins
 CORS(app, resources={
@@ -50,6 +262,7 @@ CORS(app, resources={
         "allow_headers": ["Content-Type", "Authorization"]
     }
 })
+mark_startup('flask_app')
 
 # Agent Configuration
 AGENT_CONFIG = {
@@ -85,391 +298,4002 @@ AGENT_CONFIG = {
         "health": "/health",
         "info": "/info",
         "analyze": "/analyze",
+        "analyze_batch": "/analyze/batch",  # Several sectors in one call
+        "analyze_stream": "/analyze/stream",  # Server-Sent Events
         "register": "/register",  # For supervisor registration
-        "task_status": "/task/<task_id>"  # Check task status
+        "task_status": "/task/<task_id>",  # Check task status, ?wait=<seconds> long-polls
+        "task_status_bulk": "/tasks/status",  # Status of many tasks in one call
+        "metrics": "/metrics",  # Prometheus metrics
+        "livez": "/livez",  # Liveness probe
+        "readyz": "/readyz",  # Readiness probe
+        "webhook_dead_letters": "/webhooks/dead-letters"  # Undelivered supervisor callbacks
     },
     "base_url": "https://minahilasif222.pythonanywhere.com"
 }
 
+# Runtime Settings (override via environment variables)
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '4'))  # Threads running async analyses
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('ANALYSIS_QUEUE_SIZE', '100'))  # Async tasks allowed to wait
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '20'))  # Items accepted per /analyze/batch call
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))  # Items analyzed in parallel
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '256'))  # 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(2 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))  # Seconds a cached analysis stays fresh
+TASK_TTL = float(os.environ.get('TASK_TTL', '3600'))  # Seconds a finished task stays queryable
+TASK_MAX_COUNT = int(os.environ.get('TASK_MAX_COUNT', '10000'))
+TASK_MAX_BYTES = int(os.environ.get('TASK_MAX_BYTES', str(50 * 1024 * 1024)))
+TASK_EXPIRED_MEMORY = int(os.environ.get('TASK_EXPIRED_MEMORY', '10000'))  # Evicted ids remembered as "expired"
+MEMORY_BACKEND = os.environ.get('MEMORY_BACKEND', 'memory').lower()  # memory or sqlite
+MEMORY_SQLITE_PATH = os.environ.get('MEMORY_SQLITE_PATH', 'agent_memory.db')
+HISTORY_MAX_ROWS = int(os.environ.get('HISTORY_MAX_ROWS', '200000'))  # Long-term rows kept in SQLite
+LONG_TERM_LOG_DIR = os.environ.get('LONG_TERM_LOG_DIR', 'long_term_log')  # Empty keeps history in memory only
+LONG_TERM_MEMORY_SIZE = int(os.environ.get('LONG_TERM_MEMORY_SIZE', '1000'))  # Newest entries kept in memory
+LONG_TERM_SEGMENT_SIZE = int(os.environ.get('LONG_TERM_SEGMENT_SIZE', '10000'))  # Entries per segment file
+LONG_TERM_MAX_SEGMENTS = int(os.environ.get('LONG_TERM_MAX_SEGMENTS', '20'))  # Older segments are deleted
+TREND_LEXICON_PATH = os.environ.get('TREND_LEXICON_PATH')  # Optional JSON lexicon for fallback analysis
+GEMINI_BACKEND = os.environ.get('GEMINI_BACKEND', 'google').lower()  # google or simulated
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'models/gemini-pro-latest')  # Heavy tier (and default) model
+GEMINI_FAST_MODEL = os.environ.get('GEMINI_FAST_MODEL', 'models/gemini-flash-latest')  # Fast tier, empty = use GEMINI_MODEL
+HEAVY_QUERY_TYPES = os.environ.get('HEAVY_QUERY_TYPES', 'trend_forecast,startup_insights')  # Routed to the heavy tier
+LOCAL_QUERY_TYPES = os.environ.get('LOCAL_QUERY_TYPES', '')  # Answered by keyword analysis only
+HEAVY_KEYWORD_COUNT = int(os.environ.get('HEAVY_KEYWORD_COUNT', '8'))  # This many keywords also means heavy
+HEAVY_MIN_BUDGET = float(os.environ.get('HEAVY_MIN_BUDGET', '10'))  # Seconds of deadline the heavy tier needs
+FAST_MIN_BUDGET = float(os.environ.get('FAST_MIN_BUDGET', '1'))  # Below this, answer locally
+MODEL_FAST_CONCURRENCY = int(os.environ.get('MODEL_FAST_CONCURRENCY', '0'))  # 0 = limited only by the Gemini limiter
+MODEL_HEAVY_CONCURRENCY = int(os.environ.get('MODEL_HEAVY_CONCURRENCY', '2'))  # Overflow spills to the fast tier
+GEMINI_PACKING = os.environ.get('GEMINI_PACKING', 'false').lower() == 'true'  # Pack concurrent analyses into one prompt
+PACKING_WINDOW_MS = float(os.environ.get('PACKING_WINDOW_MS', '20'))  # How long to gather analyses per packed call
+PACKING_MAX_ITEMS = int(os.environ.get('PACKING_MAX_ITEMS', '8'))  # Analyses per packed call
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8'))  # Ceiling for in-flight Gemini calls
+GEMINI_MIN_CONCURRENCY = int(os.environ.get('GEMINI_MIN_CONCURRENCY', '1'))  # Floor after adaptive backoff
+GEMINI_QUEUE_SIZE = int(os.environ.get('GEMINI_QUEUE_SIZE', '32'))  # Calls allowed to wait for a slot
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get('GEMINI_QUEUE_TIMEOUT', '10'))  # Seconds a call may wait
+GEMINI_RATE_LIMIT = float(os.environ.get('GEMINI_RATE_LIMIT', '0'))  # Calls per second, 0 = unlimited
+GEMINI_RATE_BURST = float(os.environ.get('GEMINI_RATE_BURST', '0'))  # Token bucket size, 0 = max(1, rate)
+GEMINI_LATENCY_TARGET = float(os.environ.get('GEMINI_LATENCY_TARGET', '0'))  # Slower calls shrink the limit, 0 = off
+GEMINI_OVERLOAD_POLICY = os.environ.get('GEMINI_OVERLOAD_POLICY', 'reject').lower()  # reject (429) or fallback
+GEMINI_BREAKER_WINDOW = int(os.environ.get('GEMINI_BREAKER_WINDOW', '20'))  # Recent calls considered
+GEMINI_BREAKER_MIN_CALLS = int(os.environ.get('GEMINI_BREAKER_MIN_CALLS', '10'))  # Calls needed before tripping
+GEMINI_BREAKER_ERROR_RATE = float(os.environ.get('GEMINI_BREAKER_ERROR_RATE', '0.5'))  # Failure share that trips
+GEMINI_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('GEMINI_BREAKER_SLOW_CALL_SECONDS', '15'))  # Slower counts as failure
+GEMINI_BREAKER_OPEN_SECONDS = float(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', '30'))  # Wait before each recovery probe
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', '25'))  # Default budget for synchronous analyses, 0 = none
+REQUEST_DEADLINE_MAX = float(os.environ.get('REQUEST_DEADLINE_MAX', '60'))  # Cap on client-supplied budgets
+DEADLINE_BACKGROUND_COMPLETION = os.environ.get('DEADLINE_BACKGROUND_COMPLETION', 'true').lower() == 'true'  # Late Gemini results update the task
+INFO_REFRESH_SECONDS = float(os.environ.get('INFO_REFRESH_SECONDS', '1'))  # How long an /info snapshot is reused
+READYZ_REQUIRE_GEMINI = os.environ.get('READYZ_REQUIRE_GEMINI', 'false').lower() == 'true'  # Open breaker fails /readyz
+GEMINI_WARMUP = os.environ.get('GEMINI_WARMUP', 'false').lower() == 'true'  # Load the Gemini client in the background at startup
+WEBHOOK_DELIVERY = os.environ.get('WEBHOOK_DELIVERY', 'true').lower() == 'true'  # POST finished tasks to supervisor URLs
+WEBHOOK_BATCH_WINDOW_MS = float(os.environ.get('WEBHOOK_BATCH_WINDOW_MS', '50'))  # How long to gather tasks per POST
+WEBHOOK_BATCH_MAX = int(os.environ.get('WEBHOOK_BATCH_MAX', '20'))  # Tasks per POST
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '5'))  # Then the batch is dead-lettered
+WEBHOOK_BACKOFF = float(os.environ.get('WEBHOOK_BACKOFF', '0.5'))  # Seconds before the first retry, doubled each time
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '5'))  # Seconds per POST
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', '4'))  # POSTs in flight (also connections kept per host)
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))  # Tasks waiting for delivery, overflow is dead-lettered
+WEBHOOK_DEAD_LETTER_SIZE = int(os.environ.get('WEBHOOK_DEAD_LETTER_SIZE', '100'))  # Failed batches kept for inspection
+WEBHOOK_ALLOWED_HOSTS = os.environ.get('WEBHOOK_ALLOWED_HOSTS', '')  # Comma-separated callback hosts, empty = any public host
+TASK_WAIT_MAX = float(os.environ.get('TASK_WAIT_MAX', '30'))  # Longest ?wait= a status request may block
+TASK_WAIT_MAX_WAITERS = int(os.environ.get('TASK_WAIT_MAX_WAITERS', '100'))  # Concurrent ASGI long-polls, more answer at once
+TASK_WAIT_MAX_THREAD_WAITERS = os.environ.get('TASK_WAIT_MAX_THREAD_WAITERS', '')  # Flask long-polls per process, default half the worker threads
+TASK_WAIT_RECHECK = float(os.environ.get('TASK_WAIT_RECHECK', '1'))  # SQLite backend: re-read interval for other workers' updates
+TASK_STATUS_MAX_IDS = int(os.environ.get('TASK_STATUS_MAX_IDS', '100'))  # Task ids per POST /tasks/status
+
+# Simulated Gemini Backend
+# Offline stand-in for the Gemini model with configurable latency and
+# failure injection, selected with GEMINI_BACKEND=simulated.
+class SimulatedGeminiError(Exception):
+    """Injected Gemini API failure"""
+
+class SimulatedGeminiResponse:
+    """Mimics the .text attribute of Gemini responses and stream chunks"""
+    def __init__(self, text):
+        self.text = text
+
+class SimulatedGeminiModel:
+    """Gemini-compatible model returning generated JSON after a simulated delay
+
+    latency_distribution is fixed, uniform (mean +/- jitter), normal
+    (std-dev jitter) or lognormal (median mean, jitter as sigma in ms).
+    Each call independently fails (error_rate), hangs for timeout_seconds
+    then raises TimeoutError (timeout_rate), returns unparseable text
+    (malformed_rate), or wraps the JSON in a markdown fence (fenced_rate).
+    Packed prompts get a keyed object with malformed_rate applied per item.
+    """
+    DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal')
+    STREAM_CHUNKS = 4
+    simulated = True
+    PACKED_ITEM = re.compile(r'^(item_\d+) \| Sector: .*? \| Keywords/Indicators: (.*?) \| Analysis Type:', re.MULTILINE)
+
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, latency_distribution='normal',
+                 error_rate=0.0, timeout_rate=0.0, timeout_seconds=30.0,
+                 malformed_rate=0.0, fenced_rate=0.0, seed=None):
+        if latency_distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.malformed_rate = malformed_rate
+        self.fenced_rate = fenced_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, tier=None):
+        """Build a simulator from SIMULATED_GEMINI_* environment variables
+
+        SIMULATED_GEMINI_<TIER>_LATENCY_MS / _JITTER_MS override the latency
+        for one model tier (e.g. FAST).
+        """
+        seed = os.environ.get('SIMULATED_GEMINI_SEED')
+        prefix = f"SIMULATED_GEMINI_{tier.upper()}_" if tier else "SIMULATED_GEMINI_"
+        return cls(
+            latency_ms=float(os.environ.get(prefix + 'LATENCY_MS', os.environ.get('SIMULATED_GEMINI_LATENCY_MS', '800'))),
+            jitter_ms=float(os.environ.get(prefix + 'JITTER_MS', os.environ.get('SIMULATED_GEMINI_JITTER_MS', '200'))),
+            latency_distribution=os.environ.get('SIMULATED_GEMINI_DISTRIBUTION', 'normal').lower(),
+            error_rate=float(os.environ.get('SIMULATED_GEMINI_ERROR_RATE', '0')),
+            timeout_rate=float(os.environ.get('SIMULATED_GEMINI_TIMEOUT_RATE', '0')),
+            timeout_seconds=float(os.environ.get('SIMULATED_GEMINI_TIMEOUT_SECONDS', '30')),
+            malformed_rate=float(os.environ.get('SIMULATED_GEMINI_MALFORMED_RATE', '0')),
+            fenced_rate=float(os.environ.get('SIMULATED_GEMINI_FENCED_RATE', '0')),
+            seed=int(seed) if seed else None
+        )
+
+    def _latency(self):
+        if self.latency_distribution == 'fixed':
+            latency = self.latency_ms
+        elif self.latency_distribution == 'uniform':
+            latency = self.random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+        elif self.latency_distribution == 'normal':
+            latency = self.random.gauss(self.latency_ms, self.jitter_ms)
+        else:
+            sigma = self.jitter_ms / self.latency_ms if self.latency_ms else 0.0
+            latency = self.latency_ms * self.random.lognormvariate(0, sigma)
+        return max(latency, 0.0) / 1000
+
+    def _plan(self, prompt):
+        """Draw latency, outcome and response text for one call"""
+        with self.lock:
+            self.calls += 1
+            latency = self._latency()
+            roll = self.random.random()
+            if roll < self.timeout_rate:
+                return self.timeout_seconds, 'timeout', None
+            roll -= self.timeout_rate
+            if roll < self.error_rate:
+                return latency, 'error', None
+            roll -= self.error_rate
+            packed = self.PACKED_ITEM.findall(prompt)
+            if roll < self.malformed_rate and not packed:
+                return latency, 'ok', "Here is my analysis: the trend is rising {strength: strong"
+
+            if packed:
+                # Packed prompt: keyed object, malformed_rate applies per item
+                text = json.dumps({
+                    item_id: self._analysis(keywords) if self.random.random() >= self.malformed_rate else "unavailable"
+                    for item_id, keywords in packed
+                }, indent=2)
+            else:
+                match = re.search(r'^Keywords/Indicators: (.*)$', prompt, re.MULTILINE)
+                text = json.dumps(self._analysis(match.group(1) if match else ''), indent=2)
+            if self.random.random() < self.fenced_rate:
+                text = f"```json\n{text}\n```"
+            return latency, 'ok', text
+
+    def _analysis(self, keywords):
+        keywords = [k for k in keywords.split(', ') if k][:3]
+        return {
+            "trend_direction": self.random.choice(["Rising", "Stable", "Declining"]),
+            "strength": self.random.choice(["Strong", "Moderate", "Weak"]),
+            "confidence": round(self.random.uniform(0.6, 0.95), 2),
+            "key_patterns": keywords or ["general market activity"],
+            "insights": ["Simulated insight: demand is shifting", "Simulated insight: competition rising"],
+            "recommendation": "Simulated recommendation: monitor the sector"
+        }
+
+    def _chunks(self, text):
+        size = max(1, -(-len(text) // self.STREAM_CHUNKS))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _raise(self, outcome):
+        if outcome == 'timeout':
+            raise TimeoutError(f"Simulated Gemini timeout after {self.timeout_seconds}s")
+        raise SimulatedGeminiError("Simulated Gemini API error")
+
+    def generate_content(self, prompt, stream=False):
+        """Blocking call, returns a response or (stream=True) an iterator of chunks"""
+        if stream:
+            return self._stream(prompt)
+        latency, outcome, text = self._plan(prompt)
+        time.sleep(latency)
+        if outcome != 'ok':
+            self._raise(outcome)
+        return SimulatedGeminiResponse(text)
+
+    def _stream(self, prompt):
+        latency, outcome, text = self._plan(prompt)
+        if outcome != 'ok':
+            time.sleep(latency)
+            self._raise(outcome)
+        chunks = self._chunks(text)
+        for chunk in chunks:
+            time.sleep(latency / len(chunks))
+            yield SimulatedGeminiResponse(chunk)
+
+    async def generate_content_async(self, prompt):
+        """Asyncio variant of generate_content"""
+        latency, outcome, text = self._plan(prompt)
+        await asyncio.sleep(latency)
+        if outcome != 'ok':
+            self._raise(outcome)
+        return SimulatedGeminiResponse(text)
+
 # Configure Gemini API
-def configure_gemini():
-    """Configure Google Gemini API"""
+def configure_gemini(model_name=GEMINI_MODEL, tier=None):
+    """Configure the Gemini backend (Google API or local simulator)"""
+    if GEMINI_BACKEND == 'simulated':
+        model = SimulatedGeminiModel.from_env(tier)
+        logger.info(f"Using simulated Gemini backend{f' for {tier} tier' if tier else ''} "
+                    f"({model.latency_distribution}, {model.latency_ms:.0f}ms mean, {model.error_rate:.0%} errors)")
+        return model
+    
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         logger.warning("GEMINI_API_KEY not set - using fallback analysis mode")
         return None
     
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        logger.warning("google-generativeai not installed - using fallback analysis mode")
+        return None
+    
     try:
         genai.configure(api_key=api_key)
         # Use stable model that supports generateContent
-        model = genai.GenerativeModel('models/gemini-pro-latest')
-        logger.info("Gemini API configured successfully (models/gemini-pro-latest)")
+        model = genai.GenerativeModel(model_name)
+        logger.info(f"Gemini API configured successfully ({model_name})")
         return model
     except Exception as e:
         logger.error(f"Failed to configure Gemini: {e}")
         return None
 
-# Initialize Gemini model
-gemini_model = configure_gemini()
+def gemini_configured():
+    """Whether a Gemini backend is set up, checked without importing the SDK"""
+    if GEMINI_BACKEND == 'simulated':
+        return True
+    if not os.environ.get('GEMINI_API_KEY'):
+        logger.warning("GEMINI_API_KEY not set - using fallback analysis mode")
+        return False
+    try:
+        found = importlib.util.find_spec('google.generativeai') is not None
+    except ModuleNotFoundError:
+        found = False
+    if not found:
+        logger.warning("google-generativeai not installed - using fallback analysis mode")
+    return found
 
-# Simple Memory Management
-class SimpleMemory:
-    def __init__(self):
-        self.short_term = deque(maxlen=50)  # Last 50 analyses
-        self.long_term = []  # Successful analyses (max 1000)
-        self.task_queue = {}  # Store tasks with status
-        self.registered_supervisors = []  # Track registered supervisors
-        
-    def add_short_term(self, data):
-        """Add to short-term memory"""
-        self.short_term.append({
-            'timestamp': datetime.now().isoformat(),
-            'data': data
-        })
-    
-    def add_long_term(self, data):
-        """Add to long-term memory"""
-        if len(self.long_term) < 1000:
-            self.long_term.append({
-                'timestamp': datetime.now().isoformat(),
-                'data': data
-            })
-    
-    def add_task(self, task_id, task_data):
-        """Add task to queue"""
-        self.task_queue[task_id] = {
-            'status': 'pending',
-            'data': task_data,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
-    
-    def update_task(self, task_id, status, result=None):
-        """Update task status"""
-        if task_id in self.task_queue:
-            self.task_queue[task_id]['status'] = status
-            self.task_queue[task_id]['updated_at'] = datetime.now().isoformat()
-            if result:
-                self.task_queue[task_id]['result'] = result
-    
-    def get_task(self, task_id):
-        """Get task by ID"""
-        return self.task_queue.get(task_id)
+class LazyGeminiModel:
+    """Gemini model configured on first use, so startup never waits on the SDK
+
+    Attribute access (generate_content, ...) loads the model. Once loading
+    has failed the proxy is falsy and callers take the fallback path.
+    """
+    def __init__(self, model_name=GEMINI_MODEL, tier=None):
+        self.model_name = model_name
+        self.tier = tier
+        self.lock = threading.Lock()
+        self.model = None
+        self.failed = False
+        self.load_seconds = None
+
+    def __bool__(self):
+        return not self.failed
+
+    @property
+    def simulated(self):
+        return GEMINI_BACKEND == 'simulated'
+
+    def load(self):
+        """Return the configured model, configuring it on the first call"""
+        if self.model is None and not self.failed:
+            with self.lock:
+                if self.model is None and not self.failed:
+                    started = time.perf_counter()
+                    model = configure_gemini(self.model_name, self.tier)
+                    self.load_seconds = time.perf_counter() - started
+                    self.failed = model is None
+                    self.model = model
+                    if model is not None:
+                        logger.info(f"Gemini model {self.model_name} loaded in {self.load_seconds * 1000:.0f}ms")
+        if self.model is None:
+            raise RuntimeError(f"Gemini model {self.model_name} is unavailable")
+        return self.model
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+def warm_up_gemini():
+    """Load the Gemini models on a background thread when GEMINI_WARMUP is set"""
+    models = [model for model in (gemini_model, gemini_fast_model) if isinstance(model, LazyGeminiModel)]
+    if not GEMINI_WARMUP or not models:
+        return None
     
-    def register_supervisor(self, supervisor_info):
-        """Register a supervisor agent"""
-        self.registered_supervisors.append({
-            'supervisor_id': supervisor_info.get('supervisor_id'),
-            'supervisor_url': supervisor_info.get('supervisor_url'),
-            'registered_at': datetime.now().isoformat()
-        })
+    def load_models():
+        for model in models:
+            try:
+                model.load()
+            except Exception as e:
+                logger.warning(f"Gemini warm-up failed: {e}")
     
+    thread = threading.Thread(target=load_models, name='gemini-warmup', daemon=True)
+    thread.start()
+    return thread
+
+# Initialize Gemini model (configured lazily on first use)
+gemini_model = LazyGeminiModel() if gemini_configured() else None
+gemini_fast_model = LazyGeminiModel(GEMINI_FAST_MODEL, 'fast') if gemini_model and GEMINI_FAST_MODEL else None
+mark_startup('gemini_client')
+
+# Model Routing
+# Requests go to a fast model, a heavy model, or local keyword analysis
+# depending on query type, keyword count and the remaining deadline.
+class ModelTier:
+    """One routing target with its own concurrency cap and latency stats"""
+    def __init__(self, name, model_name, max_concurrency=0, model_lookup=None):
+        self.name = name
+        self.model_name = model_name
+        self.model_lookup = model_lookup  # Returns the tier's own model, None = use gemini_model
+        self.max_concurrency = max_concurrency  # 0 = unlimited
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.spilled = 0
+        self.latencies = deque(maxlen=1000)
+
+    @property
+    def model(self):
+        """Model for this tier, looked up per call so swapped globals take effect"""
+        return (self.model_lookup() if self.model_lookup else None) or gemini_model
+
+    def try_enter(self):
+        """Take a slot, returns False when the tier is at its cap"""
+        with self.lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.spilled += 1
+                return False
+            self.in_flight += 1
+            self.calls += 1
+            return True
+
+    @contextmanager
+    def track(self):
+        """Release the slot taken by try_enter, recording successful call latency"""
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            with self.lock:
+                self.in_flight -= 1
+                if not failed:
+                    self.latencies.append(latency)
+            if not failed:
+                metrics.observe('agent_model_tier_duration_seconds', (self.name,), latency)
+
     def get_stats(self):
-        """Get memory statistics"""
+        """Get tier statistics"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            in_flight, calls, spilled = self.in_flight, self.calls, self.spilled
         return {
-            "short_term_count": len(self.short_term),
-            "short_term_capacity": 50,
-            "long_term_count": len(self.long_term),
-            "long_term_capacity": 1000,
-            "active_tasks": len(self.task_queue),
-            "registered_supervisors": len(self.registered_supervisors)
+            "model": self.model_name,
+            "max_concurrency": self.max_concurrency or None,
+            "in_flight": in_flight,
+            "calls": calls,
+            "spilled": spilled,
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None
         }
 
-# Initialize memory
-memory = SimpleMemory()
+class ModelRouter:
+    """Pick a model tier per request and enforce per-tier concurrency"""
+    FAST = 'fast'
+    HEAVY = 'heavy'
+    LOCAL = 'local'
 
-# Fallback Analysis (when Gemini API not available)
-def fallback_analysis(sector, keywords):
-    """Simple keyword-based analysis when API unavailable"""
-    
-    # Trend keywords mapping
-    positive_trends = ['growth', 'innovation', 'adoption', 'expansion', 'increase', 
-                       'rising', 'emerging', 'digital', 'AI', 'automation', 'cloud',
-                       'sustainable', 'green', 'remote', 'online']
-    
-    negative_trends = ['decline', 'reduction', 'traditional', 'offline', 'legacy']
-    
-    # Analyze keywords
-    text = ' '.join(keywords).lower()
-    positive_count = sum(1 for word in positive_trends if word in text)
-    negative_count = sum(1 for word in negative_trends if word in text)
-    
-    # Determine trend
-    if positive_count > negative_count:
-        trend_direction = "Rising"
-        strength = "Strong" if positive_count >= 3 else "Moderate"
-    elif negative_count > positive_count:
-        trend_direction = "Declining"
-        strength = "Moderate"
-    else:
-        trend_direction = "Stable"
-        strength = "Moderate"
-    
-    # Generate insights based on sector
-    sector_insights = {
-        "Technology": ["AI and automation adoption increasing", "Cloud computing growth"],
-        "E-commerce": ["Mobile commerce expanding", "Personalization trending"],
-        "Healthcare": ["Telemedicine adoption rising", "Digital health innovations"],
-        "Sustainability": ["Green business practices growing", "Renewable energy focus"],
-        "Finance": ["Digital banking expanding", "Fintech innovations"],
-        "Education": ["Online learning growth", "EdTech adoption"],
-        "Manufacturing": ["Industry 4.0 adoption", "Automation increasing"],
-        "Retail": ["Omnichannel strategies", "Customer experience focus"]
-    }
-    
-    insights = sector_insights.get(sector, ["Market evolution ongoing", "Digital transformation trending"])
-    
-    return {
-        "sector": sector,
-        "trend_direction": trend_direction,
-        "strength": strength,
-        "confidence": 0.65,
-        "key_patterns": keywords[:3],
-        "insights": insights,
-        "recommendation": f"Monitor {sector} sector closely for emerging opportunities"
-    }
+    def __init__(self, tiers, heavy_query_types, local_query_types, heavy_keyword_count,
+                 heavy_min_budget, fast_min_budget):
+        self.tiers = tiers
+        self.heavy_query_types = heavy_query_types
+        self.local_query_types = local_query_types
+        self.heavy_keyword_count = heavy_keyword_count
+        self.heavy_min_budget = heavy_min_budget
+        self.fast_min_budget = fast_min_budget
 
-# AI-Powered Analysis using Gemini
-def analyze_with_gemini(sector, keywords, query_type="general"):
-    """Use Gemini API for advanced trend analysis"""
-    
-    if not gemini_model:
-        logger.info("Gemini not available, using fallback analysis")
-        return fallback_analysis(sector, keywords)
-    
-    try:
-        # Create analysis prompt
-        prompt = f"""You are a business trend analyst. Analyze the following:
+    def choose(self, query_type, keywords, deadline=None):
+        """Preferred tier name for a request"""
+        remaining = deadline - time.monotonic() if deadline is not None else None
+        if query_type in self.local_query_types or (remaining is not None and remaining < self.fast_min_budget):
+            return self.LOCAL
+        heavy = query_type in self.heavy_query_types or len(keywords) >= self.heavy_keyword_count
+        if heavy and (remaining is None or remaining >= self.heavy_min_budget):
+            return self.HEAVY
+        return self.FAST
 
-Sector: {sector}
-Keywords/Indicators: {', '.join(keywords)}
-Analysis Type: {query_type}
+    def select(self, query_type, keywords, deadline=None):
+        """Choose a tier and take a slot in it (heavy spills to fast, fast to local)
 
-Provide a structured analysis in the following JSON format:
-{{
-    "trend_direction": "Rising/Declining/Stable",
-    "strength": "Strong/Moderate/Weak",
-    "confidence": 0.0-1.0,
-    "key_patterns": ["pattern1", "pattern2", "pattern3"],
-    "insights": ["insight1", "insight2", "insight3"],
-    "recommendation": "Brief actionable recommendation"
-}}
+        The caller must release the slot with `with tier.track():`.
+        """
+        name = self.choose(query_type, keywords, deadline)
+        for candidate in {self.HEAVY: (self.HEAVY, self.FAST), self.FAST: (self.FAST,)}.get(name, ()):
+            if self.tiers[candidate].try_enter():
+                return self.tiers[candidate]
+        local = self.tiers[self.LOCAL]
+        local.try_enter()
+        return local
 
-Focus on: emerging patterns, business implications, and actionable insights.
-Keep insights concise and business-focused."""
+    def get_stats(self):
+        """Get routing statistics per tier"""
+        return {name: tier.get_stats() for name, tier in self.tiers.items()}
 
-        # Generate response
-        response = gemini_model.generate_content(prompt)
-        
-        # Parse JSON response
-        response_text = response.text.strip()
-        
-        # Extract JSON from markdown code blocks if present
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in response_text:
-            response_text = response_text.split('```')[1].split('```')[0].strip()
-        
-        result = json.loads(response_text)
-        result['sector'] = sector
-        
-        logger.info(f"Gemini analysis successful for {sector}")
-        return result
-        
-    except json.JSONDecodeError as e:
-        logger.warning(f"JSON parse error from Gemini response: {e}")
-        return fallback_analysis(sector, keywords)
-    except Exception as e:
-        logger.error(f"Gemini API error: {e}")
-        return fallback_analysis(sector, keywords)
+def parse_name_list(value):
+    """Parse 'a, b,c' into a set of names"""
+    return {name.strip() for name in value.split(',') if name.strip()}
 
-# Flask Routes
+model_router = ModelRouter(
+    {
+        ModelRouter.FAST: ModelTier(ModelRouter.FAST, GEMINI_FAST_MODEL or GEMINI_MODEL, MODEL_FAST_CONCURRENCY,
+                                    lambda: gemini_fast_model),
+        ModelRouter.HEAVY: ModelTier(ModelRouter.HEAVY, GEMINI_MODEL, MODEL_HEAVY_CONCURRENCY),
+        ModelRouter.LOCAL: ModelTier(ModelRouter.LOCAL, "keyword-analysis")
+    },
+    parse_name_list(HEAVY_QUERY_TYPES), parse_name_list(LOCAL_QUERY_TYPES),
+    HEAVY_KEYWORD_COUNT, HEAVY_MIN_BUDGET, FAST_MIN_BUDGET
+)
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    logger.info("Health check requested")
-    
-    return jsonify({
-        "status": "active",
-        "agent_id": AGENT_CONFIG["agent_id"],
-        "agent_name": AGENT_CONFIG["agent_name"],
-        "version": AGENT_CONFIG["version"],
-        "gemini_status": "connected" if gemini_model else "fallback_mode",
-        "timestamp": datetime.now().isoformat()
-    }), 200
+# Gemini Concurrency Limiter
+class GeminiOverloaded(Exception):
+    """No Gemini slot became available, retry_after is a hint in seconds"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
 
-@app.route('/info', methods=['GET'])
-def agent_info():
-    """Return agent information"""
-    logger.info("Info requested")
-    
-    return jsonify({
-        "agent_id": AGENT_CONFIG["agent_id"],
-        "agent_name": AGENT_CONFIG["agent_name"],
-        "version": AGENT_CONFIG["version"],
-        "description": AGENT_CONFIG["description"],
-        "team": AGENT_CONFIG["team"],
-        "capabilities": AGENT_CONFIG["capabilities"],
-        "supported_sectors": AGENT_CONFIG["supported_sectors"],
-        "memory_stats": memory.get_stats(),
-        "status": "ready",
-        "agent_type": AGENT_CONFIG["agent_type"],
-        "communication_protocol": AGENT_CONFIG["communication_protocol"],
-        "endpoints": AGENT_CONFIG["endpoints"],
-        "base_url": AGENT_CONFIG["base_url"],
-        "timestamp": datetime.now().isoformat()
-    }), 200
+class GeminiLimiter:
+    """Adaptive concurrency limit plus optional token bucket for Gemini calls
 
-@app.route('/register', methods=['POST'])
-def register_with_supervisor():
-    """Allow supervisor to register with this agent"""
-    try:
-        data = request.get_json()
-        
-        if not data or 'supervisor_id' not in data:
-            return jsonify({
-                "status": "error",
-                "message": "supervisor_id required",
-                "agent_id": AGENT_CONFIG["agent_id"]
-            }), 400
-        
-        # Store supervisor information
-        memory.register_supervisor(data)
-        
-        logger.info(f"Supervisor registered: {data.get('supervisor_id')}")
-        
-        return jsonify({
-            "status": "registered",
-            "agent_id": AGENT_CONFIG["agent_id"],
-            "agent_name": AGENT_CONFIG["agent_name"],
-            "capabilities": AGENT_CONFIG["capabilities"],
-            "supported_sectors": AGENT_CONFIG["supported_sectors"],
-            "message": "Agent registered successfully with supervisor",
-            "timestamp": datetime.now().isoformat()
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"Registration error: {str(e)}")
-        return jsonify({
-            "status": "error",
-            "message": str(e),
-            "agent_id": AGENT_CONFIG["agent_id"]
-        }), 500
+    The limit grows by 1/limit after each healthy call and is cut by
+    BACKOFF after a failure or a call slower than latency_target (AIMD).
+    Callers beyond the limit wait in a bounded queue; a full queue or a
+    wait longer than queue_timeout (or past the caller's deadline) raises
+    GeminiOverloaded.
+    """
+    BACKOFF = 0.7
 
-@app.route('/task/<task_id>', methods=['GET'])
-def get_task_status(task_id):
-    """Get status of a specific task"""
-    task = memory.get_task(task_id)
-    
-    if not task:
-        return jsonify({
-            "status": "error",
-            "message": "Task not found",
-            "task_id": task_id,
-            "agent_id": AGENT_CONFIG["agent_id"]
-        }), 404
-    
-    return jsonify({
-        "status": "success",
-        "task_id": task_id,
-        "task_status": task['status'],
-        "created_at": task['created_at'],
-        "updated_at": task['updated_at'],
-        "result": task.get('result'),
-        "agent_id": AGENT_CONFIG["agent_id"],
-        "timestamp": datetime.now().isoformat()
-    }), 200
+    def __init__(self, max_limit, min_limit, max_queue, queue_timeout,
+                 rate=0.0, burst=0.0, latency_target=0.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.latency_target = latency_target
+        self.limit = float(self.max_limit)
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.avg_latency = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.decreases = 0
 
-@app.route('/analyze', methods=['POST'])
-def analyze_trends():
-    """Main analysis endpoint for business trend monitoring"""
-    
-    try:
-        # Parse request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "status": "error",
-                "message": "No JSON data provided",
-                "agent_id": AGENT_CONFIG["agent_id"],
-                "timestamp": datetime.now().isoformat()
-            }), 400
-        
-        # Extract parameters
-        sector = data.get('sector', 'Technology')
-        keywords = data.get('keywords', [])
-        query_type = data.get('type', 'general')
-        
-        # Validate sector
-        if sector not in AGENT_CONFIG["supported_sectors"]:
-            return jsonify({
-                "status": "error",
-                "message": f"Unsupported sector. Supported: {', '.join(AGENT_CONFIG['supported_sectors'])}",
-                "agent_id": AGENT_CONFIG["agent_id"],
-                "timestamp": datetime.now().isoformat()
-            }), 400
+    def _try_take(self):
+        if self.rate > 0:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+        if self.in_flight >= int(self.limit) or (self.rate > 0 and self.tokens < 1):
+            return False
+        if self.rate > 0:
+            self.tokens -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def _retry_after(self):
+        """Rough time until a queued call would get through"""
+        per_call = self.avg_latency or 1.0
+        estimate = per_call * (self.waiting + 1) / max(1, int(self.limit))
+        if self.rate > 0:
+            estimate = max(estimate, (self.waiting + 1) / self.rate)
+        return max(1, math.ceil(estimate))
+
+    def try_acquire(self):
+        """Take a slot without waiting, returns False if none is free"""
+        with self.cond:
+            return self.waiting == 0 and self._try_take()
+
+    def acquire(self, deadline=None):
+        """Take a slot, waiting in the bounded queue (until a time.monotonic() deadline) if needed"""
+        with self.cond:
+            if self.waiting == 0 and self._try_take():
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise GeminiOverloaded("Gemini wait queue is full", self._retry_after())
+            
+            self.waiting += 1
+            deadline = min(time.monotonic() + self.queue_timeout, deadline or math.inf)
+            try:
+                while not self._try_take():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise GeminiOverloaded("Timed out waiting for a Gemini slot", self._retry_after())
+                    if self.rate > 0 and self.tokens < 1:
+                        remaining = min(remaining, (1 - self.tokens) / self.rate)
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+    def reject(self, message):
+        """Count a call turned away before it reached the queue, returns the error to raise"""
+        with self.cond:
+            self.rejected += 1
+            return GeminiOverloaded(message, self._retry_after())
+
+    def release(self, latency, failed=False):
+        """Return a slot and adapt the limit to the call's outcome"""
+        with self.cond:
+            self.in_flight -= 1
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            if failed or (self.latency_target and latency > self.latency_target):
+                self.limit = max(self.min_limit, self.limit * self.BACKOFF)
+                self.decreases += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold a slot for the duration of one Gemini call"""
+        self.acquire(deadline)
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(time.perf_counter() - started, failed)
+
+    @asynccontextmanager
+    async def slot_async(self, deadline=None):
+        """Async variant of slot, only waits on a thread when the fast path fails"""
+        if not self.try_acquire():
+            await asyncio.to_thread(self.acquire, deadline)
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(time.perf_counter() - started, failed)
+
+    def get_stats(self):
+        """Get limiter statistics"""
+        with self.cond:
+            return {
+                "limit": int(self.limit),
+                "max_limit": self.max_limit,
+                "min_limit": self.min_limit,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "queue_capacity": self.max_queue,
+                "rate_limit": self.rate,
+                "avg_latency_ms": round(self.avg_latency * 1000, 1) if self.avg_latency is not None else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "limit_decreases": self.decreases,
+                "overload_policy": GEMINI_OVERLOAD_POLICY
+            }
+
+gemini_limiter = GeminiLimiter(
+    GEMINI_MAX_CONCURRENCY, GEMINI_MIN_CONCURRENCY, GEMINI_QUEUE_SIZE, GEMINI_QUEUE_TIMEOUT,
+    GEMINI_RATE_LIMIT, GEMINI_RATE_BURST, GEMINI_LATENCY_TARGET
+)
+
+# Gemini Circuit Breaker
+class GeminiCircuitOpen(Exception):
+    """Gemini calls are short-circuited while the breaker is open"""
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a window of recent call outcomes
+
+    Trips open when at least min_calls of the last `window` calls were
+    seen and the share of failures (errors or calls slower than
+    slow_call_seconds) reaches error_rate. While open every call is
+    short-circuited; a background thread probes every open_seconds
+    (half-open) and closes the breaker after a successful probe.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, probe, window, min_calls, error_rate, slow_call_seconds, open_seconds):
+        self.probe = probe
+        self.outcomes = deque(maxlen=window)  # True = failed
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.trips = 0
+        self.short_circuited = 0
+        self.probes = 0
+
+    def check(self):
+        """Raise GeminiCircuitOpen unless calls may go through"""
+        if self.state != self.CLOSED:
+            with self.lock:
+                self.short_circuited += 1
+            raise GeminiCircuitOpen(f"Gemini circuit is {self.state}")
+
+    def record(self, latency, failed):
+        """Record one call outcome, may trip the breaker"""
+        failed = failed or (self.slow_call_seconds > 0 and latency > self.slow_call_seconds)
+        with self.lock:
+            if self.state != self.CLOSED:
+                return
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.error_rate:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                self.outcomes.clear()
+                logger.warning(f"Gemini circuit opened, probing again in {self.open_seconds:g}s")
+                threading.Thread(target=self._probe_loop, name='gemini-probe', daemon=True).start()
+
+    @contextmanager
+    def track(self):
+        """Record the outcome and latency of the wrapped call"""
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.record(time.perf_counter() - started, failed)
+
+    def _probe_loop(self):
+        """Probe until Gemini answers again, then close the breaker"""
+        while True:
+            time.sleep(self.open_seconds)
+            with self.lock:
+                self.state = self.HALF_OPEN
+                self.probes += 1
+            
+            started = time.perf_counter()
+            try:
+                self.probe()
+                failed = self.slow_call_seconds > 0 and time.perf_counter() - started > self.slow_call_seconds
+            except Exception as e:
+                logger.warning(f"Gemini recovery probe failed: {e}")
+                failed = True
+            
+            with self.lock:
+                if not failed:
+                    self.state = self.CLOSED
+                    self.opened_at = None
+                    logger.info("Gemini circuit closed after successful probe")
+                    return
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def get_stats(self):
+        """Get breaker statistics"""
+        with self.lock:
+            return {
+                "state": self.state,
+                "opened_at": datetime.fromtimestamp(self.opened_at).isoformat() if self.opened_at else None,
+                "recent_calls": len(self.outcomes),
+                "recent_failures": sum(self.outcomes),
+                "error_rate_threshold": self.error_rate,
+                "slow_call_seconds": self.slow_call_seconds,
+                "trips": self.trips,
+                "short_circuited": self.short_circuited,
+                "probes": self.probes
+            }
+
+def probe_gemini():
+    """Minimal Gemini request used by the breaker's recovery probes"""
+    gemini_model.generate_content("Reply with the single word OK.")
+
+gemini_breaker = CircuitBreaker(
+    probe_gemini, GEMINI_BREAKER_WINDOW, GEMINI_BREAKER_MIN_CALLS, GEMINI_BREAKER_ERROR_RATE,
+    GEMINI_BREAKER_SLOW_CALL_SECONDS, GEMINI_BREAKER_OPEN_SECONDS
+)
+
+def gemini_status():
+    """Backend status reported by /health"""
+    if not gemini_model:
+        return "fallback_mode"
+    if gemini_breaker.state != CircuitBreaker.CLOSED:
+        return f"circuit_{gemini_breaker.state}"
+    return "simulated" if getattr(gemini_model, 'simulated', False) else "connected"
+
+# Metrics (Prometheus text format)
+class Metrics:
+    """Counters and histograms kept in per-thread shards
+
+    Recording only touches the calling thread's own dicts (no locks), the
+    shards are summed when /metrics is scraped. Shards of finished threads
+    are folded into a retired total so per-request threads do not pile up.
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.definitions = OrderedDict()  # name -> (kind, help, label names, buckets, callback)
+        self.local = threading.local()
+        self.shards = []  # (thread, (counters, histograms))
+        self.retired = ({}, {})
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text, label_names=(), callback=None):
+        self.definitions[name] = ('counter', help_text, label_names, None, callback)
+
+    def gauge(self, name, help_text, callback):
+        self.definitions[name] = ('gauge', help_text, (), None, callback)
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.definitions[name] = ('histogram', help_text, label_names, tuple(buckets), None)
+
+    def _shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = ({}, {})
+            self.local.shard = shard
+            with self.lock:
+                self.shards.append((threading.current_thread(), shard))
+                if len(self.shards) % 256 == 0:
+                    self._retire_dead()
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """Increment a counter, labels is a tuple of label values"""
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record a histogram observation"""
+        histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            buckets = self.definitions[name][3]
+            entry = histograms[key] = [0] * (len(buckets) + 2)  # bucket counts, +Inf, sum
+        entry[bisect.bisect_left(self.definitions[name][3], value)] += 1
+        entry[-1] += value
+
+    def _retire_dead(self):
+        alive = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self.retired, shard)
+        self.shards = alive
+
+    @staticmethod
+    def _merge(total, shard):
+        counters, histograms = total
+        for key, value in shard[0].copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, entry in shard[1].copy().items():
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(entry)
+            else:
+                for index, value in enumerate(entry):
+                    merged[index] += value
+
+    def collect(self):
+        """Sum all shards into (counters, histograms)"""
+        with self.lock:
+            self._retire_dead()
+            total = ({}, {})
+            self._merge(total, self.retired)
+            for thread, shard in self.shards:
+                self._merge(total, shard)
+        return total
+
+    @staticmethod
+    def _labels(label_names, values, extra=''):
+        pairs = []
+        for name, value in zip(label_names, values):
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{escaped}"')
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, label_names, buckets, callback) in self.definitions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if callback is not None:
+                try:
+                    lines.append(f"{name} {float(callback())}")
+                except Exception as e:
+                    logger.warning(f"Metric {name} failed: {e}")
+            elif kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(label_names, labels)} {value}")
+            else:
+                for (metric, labels), entry in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), entry[:-1]):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        bucket_labels = self._labels(label_names, labels, 'le="' + le + '"')
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(label_names, labels)} {entry[-1]}")
+                    lines.append(f"{name}_count{self._labels(label_names, labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+def process_memory_bytes():
+    """Resident memory of this process"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak RSS - kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+metrics = Metrics()
+metrics.counter('agent_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+metrics.histogram('agent_request_duration_seconds', 'HTTP request latency by route', ('route',))
+metrics.counter('agent_gemini_requests_total', 'Gemini calls by outcome', ('outcome',))
+metrics.histogram('agent_gemini_duration_seconds', 'Gemini call latency')
+metrics.counter('agent_analyses_total', 'Completed analyses by sector and source (gemini/fallback)', ('sector', 'source'))
+metrics.counter('agent_deadline_exceeded_total', 'Analyses answered with fallback because the deadline expired')
+metrics.histogram('agent_model_tier_duration_seconds', 'Analysis latency per model tier', ('tier',))
+metrics.counter('agent_webhook_deliveries_total', 'Supervisor webhook tasks by outcome', ('outcome',))
+metrics.counter('agent_result_cache_hits_total', 'Result cache hits', callback=lambda: memory.result_cache.hits)
+metrics.counter('agent_result_cache_misses_total', 'Result cache misses', callback=lambda: memory.result_cache.misses)
+metrics.gauge('agent_task_store_tasks', 'Tasks currently stored', lambda: len(memory.task_queue))
+metrics.gauge('agent_worker_pool_in_flight', 'Async analyses queued or running', lambda: worker_pool.get_stats()['in_flight'])
+metrics.gauge('agent_process_resident_memory_bytes', 'Resident memory of this process', process_memory_bytes)
+metrics.gauge('agent_gemini_concurrency_limit', 'Current adaptive Gemini concurrency limit', lambda: int(gemini_limiter.limit))
+metrics.gauge('agent_gemini_in_flight', 'Gemini calls in progress', lambda: gemini_limiter.in_flight)
+metrics.gauge('agent_gemini_queue_depth', 'Gemini calls waiting for a slot', lambda: gemini_limiter.waiting)
+metrics.gauge('agent_gemini_circuit_state', 'Gemini circuit breaker state (0 closed, 1 half-open, 2 open)',
+              lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1}.get(gemini_breaker.state, 2))
+
+# Analysis Result Cache
+def make_cache_key(sector, keywords, query_type):
+    """Normalize a request so equivalent analyses share one cache entry"""
+    normalized_keywords = sorted({str(keyword).strip().casefold() for keyword in keywords})
+    return (sector, tuple(normalized_keywords), str(query_type).strip().casefold())
+
+class ResultCache:
+    """LRU cache with per-entry TTL and entry/byte limits"""
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, result), oldest first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return a copy of the cached result, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, size, result = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(result)
+
+    def put(self, key, result):
+        """Store a result, evicting least recently used entries if needed"""
+        if self.max_entries <= 0:
+            return
+
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, dict(result))
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        expires_at, size, result = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        """Drop every cached result"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        """Get cache statistics"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+# Request Coalescing (single-flight)
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key"""
+    def __init__(self):
+        self.in_flight = {}  # key -> Future of the leader's call
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time, returns (result, shared)"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    async def do_async(self, key, coro_fn):
+        """Async variant of do() - awaits the shared call without blocking the event loop"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return await asyncio.wrap_future(future), True
+
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def get_stats(self):
+        """Get coalescing statistics"""
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight)
+            }
+
+# Task Store
+class TaskStore:
+    """Bounded task store - finished tasks expire after a TTL or when over budget"""
+    FINISHED_STATUSES = ('completed', 'failed')
+
+    def __init__(self, ttl, max_tasks, max_bytes, expired_memory):
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.tasks = {}  # task_id -> task
+        self.sizes = {}  # task_id -> estimated size in bytes
+        self.finished = OrderedDict()  # task_id -> finish time, oldest first (expiry order)
+        self.expired = OrderedDict()  # Recently evicted task ids
+        self.expired_memory = expired_memory
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.expired_by_ttl = 0
+        self.evicted_by_capacity = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, task_id, task_data):
+        """Add a pending task"""
+        now = datetime.now().isoformat()
+        task = {
+            'status': 'pending',
+            'data': task_data,
+            'created_at': now,
+            'updated_at': now
+        }
+        with self.lock:
+            self.tasks[task_id] = task
+            self._resize(task_id)
+            self._prune(time.monotonic())
+
+    def update(self, task_id, status, result=None):
+        """Update task status, finished tasks start their retention clock"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return
+            task['status'] = status
+            task['updated_at'] = datetime.now().isoformat()
+            if result:
+                task['result'] = result
+                self._resize(task_id)
+            if status in self.FINISHED_STATUSES:
+                self.finished[task_id] = time.monotonic()
+                self.finished.move_to_end(task_id)
+            self._prune(time.monotonic())
+
+    def get(self, task_id):
+        """Get a copy of the task, or None if unknown or expired"""
+        with self.lock:
+            self._prune(time.monotonic())
+            task = self.tasks.get(task_id)
+            return dict(task) if task else None
+
+    def get_many(self, task_ids):
+        """Get copies of several tasks, unknown or expired ids are left out"""
+        with self.lock:
+            self._prune(time.monotonic())
+            return {task_id: dict(self.tasks[task_id]) for task_id in task_ids if task_id in self.tasks}
+
+    def is_expired(self, task_id):
+        """Check if a task was evicted recently"""
+        with self.lock:
+            return task_id in self.expired
+
+    def _resize(self, task_id):
+        size = len(json.dumps(self.tasks[task_id], default=str))
+        self.total_bytes += size - self.sizes.get(task_id, 0)
+        self.sizes[task_id] = size
+
+    def _prune(self, now):
+        # Finished tasks are ordered by finish time, so expiry only looks at the front
+        while self.finished:
+            task_id, finished_at = next(iter(self.finished.items()))
+            if finished_at + self.ttl <= now:
+                self._evict(task_id)
+                self.expired_by_ttl += 1
+            elif len(self.tasks) > self.max_tasks or self.total_bytes > self.max_bytes:
+                self._evict(task_id)
+                self.evicted_by_capacity += 1
+            else:
+                break
+
+    def _evict(self, task_id):
+        self.finished.pop(task_id, None)
+        self.tasks.pop(task_id, None)
+        self.total_bytes -= self.sizes.pop(task_id, 0)
+        self.expired[task_id] = True
+        if len(self.expired) > self.expired_memory:
+            self.expired.popitem(last=False)
+
+    def get_stats(self):
+        """Get task store statistics"""
+        with self.lock:
+            return {
+                "tasks": len(self.tasks),
+                "max_tasks": self.max_tasks,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "expired_by_ttl": self.expired_by_ttl,
+                "evicted_by_capacity": self.evicted_by_capacity
+            }
+
+# Durable Storage (SQLite, WAL mode)
+class SQLiteStore:
+    """SQLite-backed task store and history log shared by all worker processes
+
+    Writes are queued and committed in batches by a background thread; until
+    then the latest copy of each task is served from an in-process overlay.
+    """
+    FINISHED_STATUSES = TaskStore.FINISHED_STATUSES
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            sector TEXT,
+            data TEXT,
+            result TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_sector ON tasks (sector);
+        CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_finished_at ON tasks (finished_at);
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            sector TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_kind_timestamp ON history (kind, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_history_kind_id ON history (kind, id);
+        CREATE INDEX IF NOT EXISTS idx_history_sector ON history (sector);
+        CREATE TABLE IF NOT EXISTS supervisors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            supervisor_id TEXT,
+            supervisor_url TEXT,
+            registered_at TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, ttl, max_tasks, history_limits=None, write_batch=200,
+                 maintenance_interval=5.0, write_attempts=3):
+        self.path = path
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self.history_limits = history_limits or {}  # kind -> newest rows kept
+        self.write_batch = write_batch
+        self.maintenance_interval = maintenance_interval
+        self.write_attempts = write_attempts
+        self.local = threading.local()
+        self.pending = {}  # task_id -> (version, task) not yet committed
+        self.version = 0
+        self.lock = threading.Lock()
+        self.writes = queue.Queue()
+        self.batches_written = 0
+        self.rows_written = 0
+        self.expired_by_ttl = 0
+        self.evicted_by_capacity = 0
+        self.history_pruned = 0
+        self.writes_failed = 0
+
+        self.writer_pid = None
+        self._ensure_writer()
+        connection = self._connect()
+        connection.executescript(self.SCHEMA)
+        connection.commit()
+        atexit.register(self.flush)
+
+    def _ensure_writer(self):
+        """Start the writer thread, again in each forked worker process
+
+        Threads and SQLite connections do not survive fork, so a process
+        that inherited this store (e.g. a preloaded server worker) gets its
+        own connections, queue and writer on first use.
+        """
+        if self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid == os.getpid():
+                return
+            self.local = threading.local()
+            self.pending = {}
+            self.writes = queue.Queue()
+            self.writer = threading.Thread(target=self._write_loop, name='sqlite-writer', daemon=True)
+            self.writer.start()
+            self.writer_pid = os.getpid()
+
+    def _connect(self):
+        self._ensure_writer()
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    # Task store API (same as TaskStore)
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM tasks WHERE status != 'expired'"
+        ).fetchone()
+        with self.lock:
+            unflushed = sum(1 for version, task in self.pending.values() if task.get('_new'))
+        return row[0] + unflushed
+
+    def add(self, task_id, task_data):
+        """Add a pending task"""
+        now = datetime.now().isoformat()
+        task = {
+            'status': 'pending',
+            'data': task_data,
+            'created_at': now,
+            'updated_at': now
+        }
+        version = self._stage(task_id, dict(task, _new=True))
+        self.writes.put((
+            "INSERT OR REPLACE INTO tasks (task_id, status, sector, data, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (task_id, 'pending', task_data.get('sector'), json.dumps(task_data), now, now),
+            task_id, version
+        ))
+
+    def update(self, task_id, status, result=None):
+        """Update task status"""
+        task = self.get(task_id)
+        if task is None:
+            return
+        task['status'] = status
+        task['updated_at'] = datetime.now().isoformat()
+        if result:
+            task['result'] = result
+        finished_at = time.time() if status in self.FINISHED_STATUSES else None
+
+        with self.lock:
+            staged = self.pending.get(task_id)
+            if staged and staged[1].get('_new'):
+                task['_new'] = True
+        version = self._stage(task_id, task)
+        self.writes.put((
+            "UPDATE tasks SET status = ?, updated_at = ?, result = COALESCE(?, result), "
+            "finished_at = ? WHERE task_id = ?",
+            (status, task['updated_at'], json.dumps(result) if result else None, finished_at, task_id),
+            task_id, version
+        ))
+
+    def get(self, task_id):
+        """Get a copy of the task, or None if unknown or expired"""
+        with self.lock:
+            staged = self.pending.get(task_id)
+        if staged:
+            task = dict(staged[1])
+            task.pop('_new', None)
+            return task
+
+        row = self._connect().execute(
+            "SELECT status, data, result, created_at, updated_at FROM tasks WHERE task_id = ?",
+            (task_id,)
+        ).fetchone()
+        if row is None or row[0] == 'expired':
+            return None
+        return self._task_from_row(row)
+
+    def get_many(self, task_ids):
+        """Get copies of several tasks with one query, unknown or expired ids are left out"""
+        tasks = {}
+        with self.lock:
+            staged = [(task_id, self.pending[task_id][1]) for task_id in task_ids if task_id in self.pending]
+        for task_id, task in staged:
+            tasks[task_id] = dict(task)
+            tasks[task_id].pop('_new', None)
+
+        remaining = [task_id for task_id in task_ids if task_id not in tasks]
+        if remaining:
+            rows = self._connect().execute(
+                "SELECT status, data, result, created_at, updated_at, task_id FROM tasks "
+                f"WHERE task_id IN ({', '.join('?' * len(remaining))})",
+                remaining
+            ).fetchall()
+            for row in rows:
+                if row[0] != 'expired':
+                    tasks[row[5]] = self._task_from_row(row)
+        return tasks
+
+    @staticmethod
+    def _task_from_row(row):
+        task = {
+            'status': row[0],
+            'data': json.loads(row[1]) if row[1] else None,
+            'created_at': row[3],
+            'updated_at': row[4]
+        }
+        if row[2]:
+            task['result'] = json.loads(row[2])
+        return task
+
+    def is_expired(self, task_id):
+        """Check if a task was removed by the retention policy"""
+        row = self._connect().execute(
+            "SELECT status FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row is not None and row[0] == 'expired'
+
+    def _stage(self, task_id, task):
+        self._ensure_writer()
+        with self.lock:
+            self.version += 1
+            self.pending[task_id] = (self.version, task)
+            return self.version
+
+    # History and supervisors
+
+    def append_history(self, kind, entry):
+        """Queue a short/long-term history entry"""
+        self._ensure_writer()
+        data = entry.get('data', {})
+        self.writes.put((
+            "INSERT INTO history (kind, timestamp, sector, data) VALUES (?, ?, ?, ?)",
+            (kind, entry['timestamp'], data.get('sector'), json.dumps(data, default=str)),
+            None, None
+        ))
+
+    def recent_history(self, kind, limit):
+        """Load the newest history entries of a kind, oldest first"""
+        rows = self._connect().execute(
+            "SELECT timestamp, data FROM history WHERE kind = ? ORDER BY id DESC LIMIT ?",
+            (kind, limit)
+        ).fetchall()
+        return [{'timestamp': timestamp, 'data': json.loads(data)} for timestamp, data in reversed(rows)]
+
+    def add_supervisor(self, supervisor):
+        """Queue a supervisor registration"""
+        self._ensure_writer()
+        self.writes.put((
+            "INSERT INTO supervisors (supervisor_id, supervisor_url, registered_at) VALUES (?, ?, ?)",
+            (supervisor['supervisor_id'], supervisor['supervisor_url'], supervisor['registered_at']),
+            None, None
+        ))
+
+    def load_supervisors(self):
+        """Load all registered supervisors"""
+        rows = self._connect().execute(
+            "SELECT supervisor_id, supervisor_url, registered_at FROM supervisors ORDER BY id"
+        ).fetchall()
+        return [
+            {'supervisor_id': row[0], 'supervisor_url': row[1], 'registered_at': row[2]}
+            for row in rows
+        ]
+
+    def supervisor_url(self, supervisor_id):
+        """Callback URL of the latest registration of a supervisor, or None"""
+        row = self._connect().execute(
+            "SELECT supervisor_url FROM supervisors WHERE supervisor_id = ? ORDER BY id DESC LIMIT 1",
+            (supervisor_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # Background writer
+
+    def flush(self, timeout=5.0):
+        """Wait until queued writes are committed"""
+        self._ensure_writer()
+        done = threading.Event()
+        self.writes.put(done)
+        done.wait(timeout)
+
+    def _write_loop(self):
+        connection = self._connect()
+        next_maintenance = time.monotonic() + self.maintenance_interval
+        while True:
+            try:
+                first = self.writes.get(timeout=self.maintenance_interval)
+            except queue.Empty:
+                first = None
+
+            batch = [first] if first is not None else []
+            while len(batch) < self.write_batch:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            statements = [item for item in batch if not isinstance(item, threading.Event)]
+            if statements:
+                self._commit(connection, statements)
+
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+            if time.monotonic() >= next_maintenance:
+                self._expire(connection)
+                next_maintenance = time.monotonic() + self.maintenance_interval
+
+    def _commit(self, connection, statements):
+        """Commit a batch, retrying transient errors, then falling back to one statement at a time"""
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                with connection:
+                    for sql, params, task_id, version in statements:
+                        connection.execute(sql, params)
+                self.batches_written += 1
+                self.rows_written += len(statements)
+                self._release(statements)
+                return
+            except sqlite3.Error as e:
+                logger.warning(f"SQLite write batch failed (attempt {attempt}/{self.write_attempts}): {e}")
+                if attempt < self.write_attempts:
+                    time.sleep(0.05 * 2 ** attempt)
+
+        # Isolate the failing statements so the rest of the batch still lands
+        failed = 0
+        for sql, params, task_id, version in statements:
+            try:
+                with connection:
+                    connection.execute(sql, params)
+                self.rows_written += 1
+            except sqlite3.Error as e:
+                failed += 1
+                logger.error(f"SQLite write dropped (task {task_id}): {e}")
+        self.writes_failed += failed
+        # Release every overlay copy either way - an uncommitted copy must not be served forever
+        self._release(statements)
+
+    def _release(self, statements):
+        # Drop overlay copies that are now fully committed
+        with self.lock:
+            for sql, params, task_id, version in statements:
+                staged = self.pending.get(task_id)
+                if staged and staged[0] == version:
+                    del self.pending[task_id]
+
+    def _expire(self, connection):
+        """Apply retention - expired rows keep their id so lookups can report it"""
+        try:
+            with connection:
+                cursor = connection.execute(
+                    "UPDATE tasks SET status = 'expired', data = NULL, result = NULL "
+                    "WHERE finished_at <= ? AND status IN ('completed', 'failed')",
+                    (time.time() - self.ttl,)
+                )
+                self.expired_by_ttl += cursor.rowcount
+
+                live = connection.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE status != 'expired'"
+                ).fetchone()[0]
+                if live > self.max_tasks:
+                    cursor = connection.execute(
+                        "UPDATE tasks SET status = 'expired', data = NULL, result = NULL "
+                        "WHERE task_id IN (SELECT task_id FROM tasks WHERE status IN ('completed', 'failed') "
+                        "ORDER BY finished_at LIMIT ?)",
+                        (live - self.max_tasks,)
+                    )
+                    self.evicted_by_capacity += cursor.rowcount
+
+                # Forget expired ids after another TTL period
+                connection.execute(
+                    "DELETE FROM tasks WHERE status = 'expired' AND finished_at <= ?",
+                    (time.time() - 2 * self.ttl,)
+                )
+
+                # Keep only the newest rows of each history kind
+                for kind, limit in self.history_limits.items():
+                    cursor = connection.execute(
+                        "DELETE FROM history WHERE kind = ? AND id <= "
+                        "(SELECT id FROM history WHERE kind = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (kind, kind, limit)
+                    )
+                    self.history_pruned += cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"SQLite retention pass failed: {e}")
+
+    def get_stats(self):
+        """Get storage statistics"""
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "tasks": len(self),
+            "max_tasks": self.max_tasks,
+            "ttl_seconds": self.ttl,
+            "pending_writes": self.writes.qsize(),
+            "uncommitted_tasks": pending,
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "expired_by_ttl": self.expired_by_ttl,
+            "evicted_by_capacity": self.evicted_by_capacity,
+            "history_limits": self.history_limits,
+            "history_pruned": self.history_pruned,
+            "writes_failed": self.writes_failed
+        }
+
+# Long-term History Log
+SEGMENT_LOCK_OFFSET = 2 ** 30  # msvcrt locks a byte range; lock one past any real data so readers are never blocked
+
+def lock_segment(segment):
+    """Take a non-blocking exclusive lock on an open segment file, False when another process holds it"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(segment.fileno(), SEGMENT_LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(segment.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def unlock_segment(segment):
+    """Release a lock taken by lock_segment"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(segment.fileno(), fcntl.LOCK_UN)
+        else:
+            os.lseek(segment.fileno(), SEGMENT_LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(segment.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+
+class SegmentedLog:
+    """Append-only history log - newest entries in memory, older ones in rolling segment files
+
+    Each process writes its own segment files (named by creation time and pid).
+    When the log opens and whenever a segment rolls, segments left by exited
+    processes are gzip-compacted in the background and the oldest are deleted
+    once more than max_segments exist. The writer holds a file lock on its open
+    segment, so a segment still being written by a live process is never
+    compacted or deleted; the lock goes away with the process.
+    """
+    SEGMENT_NAME = re.compile(r'^segment-(\d+)-(\d+)\.jsonl(\.gz)?$')
+
+    def __init__(self, directory, memory_entries, segment_entries, max_segments):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.segment_entries = segment_entries
+        self.max_segments = max_segments
+        self.recent = deque(maxlen=memory_entries)
+        self.lock = threading.Lock()
+        self.current_file = None
+        self.current_count = 0
+        self.appended = 0
+        self.segments_rolled = 0
+        self.segments_deleted = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._enforce_retention()
+            self._restore()
+            threading.Thread(target=self._compact_orphans, name='segment-compactor', daemon=True).start()
+
+    def __len__(self):
+        return len(self.recent)
+
+    def __iter__(self):
+        return iter(list(self.recent))
+
+    def append(self, entry):
+        """Append an entry - O(1), never blocks on a full log"""
+        with self.lock:
+            self.recent.append(entry)
+            self.appended += 1
+            if not self.directory:
+                return
+            try:
+                if self.current_file is None:
+                    self._open_segment()
+                self.current_file.write(json.dumps(entry, default=str) + '\n')
+                self.current_file.flush()
+                self.current_count += 1
+                if self.current_count >= self.segment_entries:
+                    self._roll()
+            except OSError as e:
+                logger.error(f"Long-term log write failed: {e}")
+
+    def recent_entries(self, limit=None):
+        """Newest entries, served from memory"""
+        with self.lock:
+            entries = list(self.recent)
+        return entries[-limit:] if limit else entries
+
+    def preload(self, entries):
+        """Seed the in-memory window without writing to disk"""
+        with self.lock:
+            self.recent.extend(entries)
+
+    def _segment_paths(self):
+        names = sorted(name for name in os.listdir(self.directory) if self.SEGMENT_NAME.match(name))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _open_segment(self):
+        name = f"segment-{int(time.time() * 1000):013d}-{os.getpid()}.jsonl"
+        self.current_file = open(os.path.join(self.directory, name), 'a', encoding='utf-8')
+        self.current_count = 0
+        if not lock_segment(self.current_file):
+            logger.warning(f"Long-term log segment {name} could not be locked")
+
+    def _in_use(self, path):
+        """Whether a plain segment is still open for writing (its writer holds the lock)"""
+        match = self.SEGMENT_NAME.match(os.path.basename(path))
+        if match is None or match.group(3):
+            return False  # Compacted segments are closed
+        if self.current_file is not None and path == self.current_file.name:
+            return True
+        try:
+            with open(path, 'rb') as segment:
+                if not lock_segment(segment):
+                    return True  # Its writer still holds the lock
+                unlock_segment(segment)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True  # Unreadable - keep it
+        return False
+
+    def _roll(self):
+        closed_path = self.current_file.name
+        unlock_segment(self.current_file)
+        self.current_file.close()
+        self.current_file = None
+        self.segments_rolled += 1
+        threading.Thread(target=self._compact, args=(closed_path,), daemon=True).start()
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """Drop the oldest segments beyond max_segments, skipping ones still being written"""
+        # A segment may briefly exist both plain and compacted while its compaction runs
+        segments = sorted({path[:-3] if path.endswith('.gz') else path for path in self._segment_paths()})
+        excess = len(segments) - self.max_segments
+        for path in segments:
+            if excess <= 0:
+                break
+            if os.path.exists(path) and self._in_use(path):
+                continue
+            for candidate in (path, path + '.gz'):
+                try:
+                    os.remove(candidate)
+                except OSError:
+                    pass  # Already gone (another process got there first)
+            self.segments_deleted += 1
+            excess -= 1
+
+    def _compact_orphans(self):
+        """Compact plain segments left behind by processes that have exited"""
+        for path in self._segment_paths():
+            if path.endswith('.jsonl') and not self._in_use(path):
+                self._compact(path)
+
+    def _compact(self, path):
+        # Write to a private temp file and rename, so a .gz segment is always complete
+        temp_path = f"{path}.gz.{os.getpid()}.tmp"
+        try:
+            with open(path, 'rb') as source, gzip.open(temp_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.replace(temp_path, path + '.gz')
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Compacted or deleted by another process meanwhile
+        except OSError as e:
+            logger.warning(f"Long-term log compaction failed for {path}: {e}")
+        finally:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _restore(self):
+        """Load the newest entries from disk into the in-memory window"""
+        restored = deque(maxlen=self.memory_entries)
+        for path in reversed(self._segment_paths()):
+            if path.endswith('.jsonl') and os.path.exists(path + '.gz'):
+                continue  # Compaction was interrupted, the .gz copy is complete
+            opener = gzip.open if path.endswith('.gz') else open
+            try:
+                with opener(path, 'rt', encoding='utf-8') as segment:
+                    lines = segment.readlines()
+            except OSError:
+                continue
+            for line in reversed(lines):
+                try:
+                    restored.appendleft(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Partially written last line
+                if len(restored) >= self.memory_entries:
+                    break
+            if len(restored) >= self.memory_entries:
+                break
+        self.recent.extend(restored)
+
+    def get_stats(self):
+        """Get log statistics"""
+        with self.lock:
+            return {
+                "in_memory": len(self.recent),
+                "memory_capacity": self.memory_entries,
+                "appended": self.appended,
+                "directory": self.directory or None,
+                "segment_entries": self.segment_entries,
+                "max_segments": self.max_segments,
+                "segments_rolled": self.segments_rolled,
+                "segments_deleted": self.segments_deleted
+            }
+
+# Simple Memory Management
+class SimpleMemory:
+    def __init__(self, backend='memory'):
+        self.short_term = deque(maxlen=50)  # Last 50 analyses
+        # Successful analyses - with the sqlite backend the history table is the
+        # durable copy, so the log only keeps the in-memory window
+        self.long_term = SegmentedLog(LONG_TERM_LOG_DIR if backend != 'sqlite' else '', LONG_TERM_MEMORY_SIZE,
+                                      LONG_TERM_SEGMENT_SIZE, LONG_TERM_MAX_SEGMENTS)
+        self.registered_supervisors = []  # Track registered supervisors
+        self.task_listeners = []  # Called with (task_id, status, result) after every task update
+        self.result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
         
-        # Generate task ID
+        if backend == 'sqlite':
+            # Durable storage - tasks and history survive restarts and are shared between processes
+            self.storage = SQLiteStore(MEMORY_SQLITE_PATH, TASK_TTL, TASK_MAX_COUNT,
+                                       {'short_term': self.short_term.maxlen, 'long_term': HISTORY_MAX_ROWS})
+            self.task_queue = self.storage
+            self.short_term.extend(self.storage.recent_history('short_term', self.short_term.maxlen))
+            self.long_term.preload(self.storage.recent_history('long_term', LONG_TERM_MEMORY_SIZE))
+            self.registered_supervisors.extend(self.storage.load_supervisors())
+        else:
+            self.storage = None
+            self.task_queue = TaskStore(TASK_TTL, TASK_MAX_COUNT, TASK_MAX_BYTES, TASK_EXPIRED_MEMORY)  # Store tasks with status
+        
+    def add_short_term(self, data):
+        """Add to short-term memory"""
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'data': data
+        }
+        self.short_term.append(entry)
+        if self.storage:
+            self.storage.append_history('short_term', entry)
+    
+    def add_long_term(self, data):
+        """Add to long-term memory"""
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'data': data
+        }
+        self.long_term.append(entry)
+        if self.storage:
+            self.storage.append_history('long_term', entry)
+    
+    def add_task(self, task_id, task_data):
+        """Add task to queue"""
+        self.task_queue.add(task_id, task_data)
+    
+    def update_task(self, task_id, status, result=None):
+        """Update task status"""
+        self.task_queue.update(task_id, status, result)
+        for listener in self.task_listeners:
+            listener(task_id, status, result)
+    
+    def get_task(self, task_id):
+        """Get task by ID"""
+        return self.task_queue.get(task_id)
+    
+    def get_tasks(self, task_ids):
+        """Get several tasks by ID, returns {task_id: task} without unknown ids"""
+        return self.task_queue.get_many(task_ids)
+    
+    def is_task_expired(self, task_id):
+        """Check if a task was removed by the retention policy"""
+        return self.task_queue.is_expired(task_id)
+    
+    def register_supervisor(self, supervisor_info):
+        """Register a supervisor agent"""
+        supervisor = {
+            'supervisor_id': supervisor_info.get('supervisor_id'),
+            'supervisor_url': supervisor_info.get('supervisor_url'),
+            'registered_at': datetime.now().isoformat()
+        }
+        self.registered_supervisors.append(supervisor)
+        if self.storage:
+            self.storage.add_supervisor(supervisor)
+    
+    def supervisor_url(self, supervisor_id):
+        """Callback URL of the latest registration of a supervisor, or None"""
+        for supervisor in reversed(self.registered_supervisors):
+            if supervisor['supervisor_id'] == supervisor_id:
+                return supervisor['supervisor_url']
+        if self.storage:
+            # Registered through another worker process
+            return self.storage.supervisor_url(supervisor_id)
+        return None
+    
+    def get_stats(self):
+        """Get memory statistics"""
+        return {
+            "short_term_count": len(self.short_term),
+            "short_term_capacity": 50,
+            "long_term_count": len(self.long_term),
+            "long_term_capacity": LONG_TERM_MEMORY_SIZE,
+            "long_term_log": self.long_term.get_stats(),
+            "active_tasks": len(self.task_queue),
+            "task_store": self.task_queue.get_stats(),
+            "registered_supervisors": len(self.registered_supervisors),
+            "result_cache": self.result_cache.get_stats()
+        }
+
+# Initialize memory
+memory = SimpleMemory(MEMORY_BACKEND)
+mark_startup('memory')
+
+# Identical analyses running at the same time share one Gemini call
+analysis_flight = SingleFlight()
+
+# Background Worker Pool (for async analysis mode)
+class AnalysisWorkerPool:
+    """Bounded thread pool - rejects new work instead of queueing without limit"""
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        """Schedule fn(*args), returns False if the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            return False
+
+        with self.lock:
+            self.in_flight += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return True
+
+    def _release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def get_stats(self):
+        """Get worker pool statistics"""
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "queue_capacity": self.max_queue,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected
+            }
+
+# Initialize worker pool
+worker_pool = AnalysisWorkerPool(ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE)
+
+# Batch requests fan out on their own pool so they never starve async tasks
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+
+# Deadline-bound analyses run here so the request thread can stop waiting.
+# Admission is capped at what the limiter can run or queue, so work never
+# waits in the executor's own (unbounded) queue - beyond that, callers are
+# turned away at once instead of after a worker frees up
+deadline_executor = ThreadPoolExecutor(
+    max_workers=GEMINI_MAX_CONCURRENCY + GEMINI_QUEUE_SIZE, thread_name_prefix='deadline'
+)
+deadline_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY + GEMINI_QUEUE_SIZE)
+
+# Supervisor Webhooks
+# Tasks created with a supervisor_id are POSTed to that supervisor's
+# registered URL when they finish, so supervisors need not poll /task.
+class WebhookURLRejected(ValueError):
+    """A supervisor callback URL that webhooks may not be sent to"""
+
+WEBHOOK_HOSTS = {host.strip().lower() for host in WEBHOOK_ALLOWED_HOSTS.split(',') if host.strip()}
+
+def check_webhook_url(url):
+    """Raise WebhookURLRejected unless url is a permitted callback target
+
+    With WEBHOOK_ALLOWED_HOSTS set only those hosts are permitted (and
+    trusted wherever they resolve). Otherwise every address the host
+    resolves to must be public, so callbacks cannot reach loopback,
+    link-local (cloud metadata) or private networks. DNS failures raise
+    OSError.
+    """
+    try:
+        parts = urlsplit(str(url))
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        raise WebhookURLRejected("supervisor_url is not a valid URL")
+    if parts.scheme not in ('http', 'https') or not host:
+        raise WebhookURLRejected("supervisor_url must be an http(s) URL")
+    if WEBHOOK_HOSTS:
+        if host.lower() not in WEBHOOK_HOSTS:
+            raise WebhookURLRejected(f"supervisor_url host {host} is not in WEBHOOK_ALLOWED_HOSTS")
+        return
+    
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+    except UnicodeError:
+        raise WebhookURLRejected(f"supervisor_url host {host} is not a valid hostname")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise WebhookURLRejected(f"supervisor_url host {host} resolves to non-public address {address}")
+
+class WebhookDispatcher:
+    """Background delivery of finished tasks to supervisor callback URLs
+
+    submit() only queues. A collector thread gathers tasks for window
+    seconds (or until max_items), groups them by URL and POSTs each group
+    as one batch over a pooled keep-alive session. Connection errors, 429
+    and 5xx answers are retried with exponential backoff; other answers,
+    a full queue or max_attempts failures move the batch to dead_letters.
+    The URL is checked again before every POST and redirects are not
+    followed, so a callback cannot be pointed at an internal address later.
+    """
+    def __init__(self, window, max_items, max_attempts, backoff, timeout, senders, max_queue, dead_letter_size):
+        self.window = window
+        self.max_items = max_items
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.senders = max(1, senders)
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.collector_pid = None
+        self.retries = []  # heap of (due, sequence, url, tasks, attempt)
+        self.sequence = 0
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        self.delivered = 0
+        self.batches = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def _ensure_collector(self):
+        """Start the collector thread and HTTP session, again in each forked worker process"""
+        if self.collector_pid == os.getpid():
+            return
+        with self.lock:
+            if self.collector_pid == os.getpid():
+                return
+            import requests  # Deferred: only needed once a webhook is sent
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.senders, pool_maxsize=self.senders)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.pending = queue.Queue(maxsize=self.max_queue)
+            self.executor = ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix='webhook')
+            self.retries = []
+            threading.Thread(target=self._collect, name='webhook-dispatcher', daemon=True).start()
+            self.collector_pid = os.getpid()
+
+    def submit(self, url, task):
+        """Queue one finished task for delivery to url"""
+        self._ensure_collector()
+        try:
+            self.pending.put_nowait((url, task))
+        except queue.Full:
+            self._dead_letter(url, [task], 0, "delivery queue is full")
+
+    def _collect(self):
+        while True:
+            with self.lock:
+                wait = max(0.0, self.retries[0][0] - time.monotonic()) if self.retries else None
+            try:
+                batch = [self.pending.get(timeout=wait)]
+            except queue.Empty:
+                batch = []
+            
+            if batch and batch[0] is not None:
+                window_ends = time.monotonic() + self.window
+                while len(batch) < self.max_items:
+                    remaining = window_ends - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.pending.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            
+            groups = {}
+            for entry in batch:
+                if entry is not None:  # None only wakes the collector for a new retry
+                    groups.setdefault(entry[0], []).append(entry[1])
+            for url, tasks in groups.items():
+                self.executor.submit(self._send, url, tasks, 1)
+            
+            now = time.monotonic()
+            with self.lock:
+                due = []
+                while self.retries and self.retries[0][0] <= now:
+                    due.append(heapq.heappop(self.retries))
+            for _, _, url, tasks, attempt in due:
+                self.executor.submit(self._send, url, tasks, attempt)
+
+    def _send(self, url, tasks, attempt):
+        """POST one batch, then record success or schedule a retry"""
+        body = dumps_json({
+            "agent_id": AGENT_CONFIG["agent_id"],
+            "event": "tasks.finished",
+            "tasks": tasks,
+            "timestamp": datetime.now().isoformat()
+        })
+        try:
+            check_webhook_url(url)
+            response = self.session.post(url, data=body, headers={'Content-Type': 'application/json'},
+                                         timeout=self.timeout, allow_redirects=False)
+            error = None if response.status_code < 300 else f"HTTP {response.status_code}"
+            retryable = response.status_code == 429 or response.status_code >= 500
+        except WebhookURLRejected as e:
+            error = str(e)
+            retryable = False
+        except Exception as e:
+            error = str(e)
+            retryable = True
+        
+        if error is None:
+            with self.lock:
+                self.delivered += len(tasks)
+                self.batches += 1
+            metrics.inc('agent_webhook_deliveries_total', ('delivered',), len(tasks))
+            return
+        
+        if not retryable or attempt >= self.max_attempts:
+            self._dead_letter(url, tasks, attempt, error)
+            return
+        
+        # Exponential backoff with jitter so retries to one receiver spread out
+        delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        logger.warning(f"Webhook delivery to {url} failed ({error}), retry {attempt} in {delay:.1f}s")
+        with self.lock:
+            self.retried += len(tasks)
+            self.sequence += 1
+            heapq.heappush(self.retries, (time.monotonic() + delay, self.sequence, url, tasks, attempt + 1))
+        metrics.inc('agent_webhook_deliveries_total', ('retried',), len(tasks))
+        try:
+            self.pending.put_nowait(None)  # Wake the collector to pick up the new due time
+        except queue.Full:
+            pass  # Collector is busy and will check retries on its next pass
+
+    def _dead_letter(self, url, tasks, attempts, error):
+        logger.error(f"Webhook delivery to {url} abandoned after {attempts} attempt(s): {error}")
+        with self.lock:
+            self.dead_lettered += len(tasks)
+            self.dead_letters.append({
+                "url": url,
+                "task_ids": [task['task_id'] for task in tasks],
+                "tasks": tasks,
+                "attempts": attempts,
+                "error": error,
+                "failed_at": datetime.now().isoformat()
+            })
+        metrics.inc('agent_webhook_deliveries_total', ('dead_lettered',), len(tasks))
+
+    def get_dead_letters(self):
+        """Batches that could not be delivered, oldest first"""
+        with self.lock:
+            return list(self.dead_letters)
+
+    def get_stats(self):
+        """Get delivery statistics"""
+        with self.lock:
+            return {
+                "enabled": WEBHOOK_DELIVERY,
+                "batch_window_ms": self.window * 1000,
+                "batch_max": self.max_items,
+                "max_attempts": self.max_attempts,
+                "delivered": self.delivered,
+                "batches": self.batches,
+                "retried": self.retried,
+                "retries_pending": len(self.retries),
+                "dead_lettered": self.dead_lettered,
+                "dead_letters": len(self.dead_letters)
+            }
+
+webhook_dispatcher = WebhookDispatcher(
+    WEBHOOK_BATCH_WINDOW_MS / 1000, WEBHOOK_BATCH_MAX, WEBHOOK_MAX_ATTEMPTS, WEBHOOK_BACKOFF,
+    WEBHOOK_TIMEOUT, WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE, WEBHOOK_DEAD_LETTER_SIZE
+)
+
+def notify_supervisor(task_id, status, result):
+    """Task listener: queue a webhook when a task with a supervisor_id finishes"""
+    if not WEBHOOK_DELIVERY or status not in ('completed', 'failed'):
+        return
+    task = memory.get_task(task_id)
+    supervisor_id = (task.get('data') or {}).get('supervisor_id') if task else None
+    if not supervisor_id:
+        return
+    url = memory.supervisor_url(supervisor_id)
+    if not url or not str(url).startswith(('http://', 'https://')):
+        return
+    webhook_dispatcher.submit(url, {
+        "task_id": task_id,
+        "supervisor_id": supervisor_id,
+        "task_status": status,
+        "sector": task['data'].get('sector'),
+        "analysis_type": task['data'].get('type'),
+        "result": result,
+        "updated_at": task['updated_at']
+    })
+
+memory.task_listeners.append(notify_supervisor)
+
+# Task Long-Polling
+# Status requests with a wait time block until a task they watch is updated,
+# woken by the task listener instead of polling the store.
+class AsyncWaiter:
+    """Event-loop side of a waiter, set() may be called from any thread"""
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+class TaskWatch:
+    """Lets status requests wait for task updates
+
+    A waiter registers on its task ids before reading them, so an update
+    landing between the read and the wait still wakes it. Updates made by
+    other worker processes (SQLite backend) fire no listener here, so
+    waiters then re-read every recheck seconds.
+    """
+    def __init__(self, max_waiters, max_thread_waiters, recheck):
+        self.max_waiters = max_waiters
+        self.max_thread_waiters = max_thread_waiters  # Each one holds a request thread
+        self.recheck = recheck  # 0 = only wake on notification
+        self.lock = threading.Lock()
+        self.waiters = {}  # task_id -> set of waiters (threading.Event or AsyncWaiter)
+        self.active = 0
+        self.active_threads = 0
+        self.long_polls = 0
+        self.changed = 0
+        self.timed_out = 0
+        self.refused = 0
+
+    def task_updated(self, task_id, status, result):
+        """Task listener: wake every request waiting on task_id"""
+        with self.lock:
+            waiters = list(self.waiters.get(task_id, ()))
+        for waiter in waiters:
+            waiter.set()
+
+    def _register(self, task_ids, waiter):
+        threaded = isinstance(waiter, threading.Event)
+        with self.lock:
+            if self.active >= self.max_waiters or (threaded and self.active_threads >= self.max_thread_waiters):
+                self.refused += 1
+                return False
+            self.active += 1
+            self.active_threads += threaded
+            self.long_polls += 1
+            for task_id in task_ids:
+                self.waiters.setdefault(task_id, set()).add(waiter)
+            return True
+
+    def _unregister(self, task_ids, waiter, changed):
+        with self.lock:
+            self.active -= 1
+            self.active_threads -= isinstance(waiter, threading.Event)
+            if changed:
+                self.changed += 1
+            else:
+                self.timed_out += 1
+            for task_id in task_ids:
+                waiters = self.waiters.get(task_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self.waiters[task_id]
+
+    @staticmethod
+    def _settled(task_ids, known):
+        """True once a task differs from its known status, or none can change any more"""
+        tasks = memory.get_tasks(task_ids)
+        unfinished = False
+        for task_id in task_ids:
+            task = tasks.get(task_id)
+            if task is None:
+                if known.get(task_id) is not None:
+                    return True  # Expired while watched
+                continue
+            known.setdefault(task_id, task['status'])
+            if task['status'] != known[task_id]:
+                return True
+            if task['status'] not in TaskStore.FINISHED_STATUSES:
+                unfinished = True
+        return not unfinished
+
+    def wait(self, task_ids, known, timeout):
+        """Block until a task's status differs from known (task_id -> status, current if missing) or timeout"""
+        waiter = threading.Event()
+        if not self._register(task_ids, waiter):
+            return
+        changed = False
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                changed = self._settled(task_ids, known)
+                remaining = deadline - time.monotonic()
+                if changed or remaining <= 0:
+                    break
+                waiter.wait(min(remaining, self.recheck) if self.recheck else remaining)
+                waiter.clear()
+        finally:
+            self._unregister(task_ids, waiter, changed)
+
+    async def wait_async(self, task_ids, known, timeout):
+        """wait() for the event loop, holds no thread while waiting"""
+        waiter = AsyncWaiter()
+        if not self._register(task_ids, waiter):
+            return
+        changed = False
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                changed = self._settled(task_ids, known)
+                remaining = deadline - time.monotonic()
+                if changed or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), min(remaining, self.recheck) if self.recheck else remaining)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        finally:
+            self._unregister(task_ids, waiter, changed)
+
+    def get_stats(self):
+        """Get long-polling statistics"""
+        with self.lock:
+            return {
+                "max_wait_seconds": TASK_WAIT_MAX,
+                "max_waiters": self.max_waiters,
+                "max_thread_waiters": self.max_thread_waiters,
+                "waiting": self.active,
+                "waiting_threads": self.active_threads,
+                "long_polls": self.long_polls,
+                "changed": self.changed,
+                "timed_out": self.timed_out,
+                "refused": self.refused
+            }
+
+def default_thread_waiters(threads):
+    """Flask long-polls allowed per process, leaving at least half the threads for other requests"""
+    return int(TASK_WAIT_MAX_THREAD_WAITERS) if TASK_WAIT_MAX_THREAD_WAITERS else max(1, threads // 2)
+
+task_watch = TaskWatch(
+    TASK_WAIT_MAX_WAITERS, default_thread_waiters(int(os.environ.get('WEB_THREADS', '8'))),
+    TASK_WAIT_RECHECK if memory.storage else 0
+)
+memory.task_listeners.append(task_watch.task_updated)
+
+# Fallback Analysis (when Gemini API not available)
+
+# Default trend lexicon - override with a JSON file via TREND_LEXICON_PATH
+DEFAULT_TREND_LEXICON = {
+    "positive": ['growth', 'innovation', 'adoption', 'expansion', 'increase',
+                 'rising', 'emerging', 'digital', 'AI', 'automation', 'cloud',
+                 'sustainable', 'green', 'remote', 'online'],
+    "negative": ['decline', 'reduction', 'traditional', 'offline', 'legacy'],
+    "sector_insights": {
+        "Technology": ["AI and automation adoption increasing", "Cloud computing growth"],
+        "E-commerce": ["Mobile commerce expanding", "Personalization trending"],
+        "Healthcare": ["Telemedicine adoption rising", "Digital health innovations"],
+        "Sustainability": ["Green business practices growing", "Renewable energy focus"],
+        "Finance": ["Digital banking expanding", "Fintech innovations"],
+        "Education": ["Online learning growth", "EdTech adoption"],
+        "Manufacturing": ["Industry 4.0 adoption", "Automation increasing"],
+        "Retail": ["Omnichannel strategies", "Customer experience focus"]
+    },
+    "default_insights": ["Market evolution ongoing", "Digital transformation trending"]
+}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def load_trend_lexicon(path):
+    """Load the trend lexicon, keys missing from the file keep their defaults"""
+    lexicon = dict(DEFAULT_TREND_LEXICON)
+    if not path:
+        return lexicon
+
+    try:
+        with open(path, encoding='utf-8') as lexicon_file:
+            lexicon.update(json.load(lexicon_file))
+        logger.info(f"Trend lexicon loaded from {path}")
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load trend lexicon from {path}: {e} - using defaults")
+    return lexicon
+
+class KeywordMatcher:
+    """Word-start trend matcher, compiled once from the lexicon
+
+    Terms (single words or phrases) are indexed by their first token, so
+    scoring is a single pass over the keyword tokens with dictionary lookups.
+    A term token also matches words it starts ("innovation" -> "innovations",
+    "green" -> "greener"); terms shorter than PREFIX_MIN_LENGTH (e.g. "AI")
+    only match whole words, and nothing matches inside a word.
+    """
+    PREFIX_MIN_LENGTH = 4
+
+    def __init__(self, positive_terms, negative_terms):
+        self.index = {}  # first token -> [(term tokens, polarity, term id)]
+        for polarity, terms in (('positive', positive_terms), ('negative', negative_terms)):
+            for term in terms:
+                tokens = tuple(TOKEN_PATTERN.findall(term.lower()))
+                if tokens:
+                    self.index.setdefault(tokens[0], []).append((tokens, polarity, (polarity, tokens)))
+        self.prefix_lengths = sorted({len(first) for first in self.index if len(first) >= self.PREFIX_MIN_LENGTH})
+
+    def _token_matches(self, term_token, token):
+        return token == term_token or (len(term_token) >= self.PREFIX_MIN_LENGTH and token.startswith(term_token))
+
+    def _candidates(self, token):
+        # Terms whose first token is this word or starts it
+        yield from self.index.get(token, ())
+        for length in self.prefix_lengths:
+            if length >= len(token):
+                break
+            yield from self.index.get(token[:length], ())
+
+    def score(self, keywords):
+        """Count distinct positive and negative terms found in the keywords"""
+        matched = set()
+        for keyword in keywords:
+            tokens = TOKEN_PATTERN.findall(str(keyword).lower())
+            for position, token in enumerate(tokens):
+                for term_tokens, polarity, term_id in self._candidates(token):
+                    following = tokens[position + 1:position + len(term_tokens)]
+                    if len(following) == len(term_tokens) - 1 and all(
+                            self._token_matches(term_token, word)
+                            for term_token, word in zip(term_tokens[1:], following)):
+                        matched.add(term_id)
+
+        positive_count = sum(1 for polarity, tokens in matched if polarity == 'positive')
+        return positive_count, len(matched) - positive_count
+
+# Compiled at import time so fallback requests only do the scoring pass
+TREND_LEXICON = load_trend_lexicon(TREND_LEXICON_PATH)
+trend_matcher = KeywordMatcher(TREND_LEXICON["positive"], TREND_LEXICON["negative"])
+SECTOR_INSIGHTS = TREND_LEXICON["sector_insights"]
+DEFAULT_INSIGHTS = TREND_LEXICON["default_insights"]
+
+def fallback_analysis(sector, keywords):
+    """Simple keyword-based analysis when API unavailable"""
+    
+    # Analyze keywords
+    positive_count, negative_count = trend_matcher.score(keywords)
+    
+    # Determine trend
+    if positive_count > negative_count:
+        trend_direction = "Rising"
+        strength = "Strong" if positive_count >= 3 else "Moderate"
+    elif negative_count > positive_count:
+        trend_direction = "Declining"
+        strength = "Moderate"
+    else:
+        trend_direction = "Stable"
+        strength = "Moderate"
+    
+    # Generate insights based on sector
+    insights = list(SECTOR_INSIGHTS.get(sector, DEFAULT_INSIGHTS))
+    
+    return {
+        "sector": sector,
+        "trend_direction": trend_direction,
+        "strength": strength,
+        "confidence": 0.65,
+        "key_patterns": keywords[:3],
+        "insights": insights,
+        "recommendation": f"Monitor {sector} sector closely for emerging opportunities",
+        "analysis_source": "fallback"
+    }
+
+# AI-Powered Analysis using Gemini
+def build_analysis_prompt(sector, keywords, query_type):
+    """Build the Gemini prompt for a trend analysis"""
+    return f"""You are a business trend analyst. Analyze the following:
+
+Sector: {sector}
+Keywords/Indicators: {', '.join(keywords)}
+Analysis Type: {query_type}
+
+Provide a structured analysis in the following JSON format:
+{{
+    "trend_direction": "Rising/Declining/Stable",
+    "strength": "Strong/Moderate/Weak",
+    "confidence": 0.0-1.0,
+    "key_patterns": ["pattern1", "pattern2", "pattern3"],
+    "insights": ["insight1", "insight2", "insight3"],
+    "recommendation": "Brief actionable recommendation"
+}}
+
+Focus on: emerging patterns, business implications, and actionable insights.
+Keep insights concise and business-focused."""
+
+JSON_DECODER = json.JSONDecoder()
+
+def extract_json(response_text):
+    """Decode the first JSON object or array in model output
+
+    Works in place on the original string: skips an optional markdown fence
+    (```json or ```) and any leading prose, decodes one value with
+    raw_decode and ignores whatever follows it (closing fence, trailing
+    prose). Raises json.JSONDecodeError if no value decodes.
+    """
+    start = 0
+    fence = response_text.find('```')
+    if fence != -1:
+        start = response_text.find('\n', fence)
+        start = fence + 3 if start == -1 else start
+    
+    error = None
+    while True:
+        brace = response_text.find('{', start)
+        bracket = response_text.find('[', start)
+        if brace == -1 and bracket == -1:
+            raise error or json.JSONDecodeError("No JSON value found", response_text, start)
+        start = bracket if brace == -1 or (bracket != -1 and bracket < brace) else brace
+        try:
+            return JSON_DECODER.raw_decode(response_text, start)[0]
+        except json.JSONDecodeError as e:
+            error = error or e
+            start += 1
+
+def parse_gemini_response(response_text, sector):
+    """Parse Gemini output into a result dict, raises json.JSONDecodeError"""
+    result = extract_json(response_text)
+    if not isinstance(result, dict):
+        raise json.JSONDecodeError("Expected a JSON object", response_text, 0)
+    result['sector'] = sector
+    result['analysis_source'] = "gemini"
+    return result
+
+# Prompt Packing
+# Concurrent analyses arriving within PACKING_WINDOW_MS share one Gemini
+# call: the packed prompt lists every item and asks for a keyed JSON object.
+def build_packed_prompt(items):
+    """Build one prompt for several (sector, keywords, query_type) items"""
+    lines = '\n'.join(
+        f"item_{index} | Sector: {sector} | Keywords/Indicators: {', '.join(keywords)} | Analysis Type: {query_type}"
+        for index, (sector, keywords, query_type) in enumerate(items)
+    )
+    return f"""You are a business trend analyst. Analyze each of the following requests independently:
+
+{lines}
+
+Respond with a single JSON object whose keys are the item ids above (item_0, item_1, ...).
+Each value must be a structured analysis in the following JSON format:
+{{
+    "trend_direction": "Rising/Declining/Stable",
+    "strength": "Strong/Moderate/Weak",
+    "confidence": 0.0-1.0,
+    "key_patterns": ["pattern1", "pattern2", "pattern3"],
+    "insights": ["insight1", "insight2", "insight3"],
+    "recommendation": "Brief actionable recommendation"
+}}
+
+Focus on: emerging patterns, business implications, and actionable insights.
+Keep insights concise and business-focused."""
+
+class PromptPacker:
+    """Micro-batches concurrent analyses into packed Gemini calls
+
+    submit() returns a Future resolving to the raw analysis dict of one
+    item. A collector thread gathers items for window seconds (or until
+    max_items), groups them by model and dispatches each group as one
+    call. A call failure fails every item of the group; an item missing or
+    malformed in the keyed response fails only that item (json.JSONDecodeError),
+    so callers fall back per item.
+    """
+    def __init__(self, window, max_items, dispatchers):
+        self.window = window
+        self.max_items = max_items
+        self.dispatchers = dispatchers
+        self.lock = threading.Lock()
+        self.collector_pid = None
+        self.packed_calls = 0
+        self.single_calls = 0
+        self.items = 0
+        self.item_failures = 0
+
+    def _ensure_collector(self):
+        """Start the collector thread, again in each forked worker process"""
+        if self.collector_pid == os.getpid():
+            return
+        with self.lock:
+            if self.collector_pid == os.getpid():
+                return
+            self.pending = queue.Queue()
+            self.executor = ThreadPoolExecutor(max_workers=self.dispatchers, thread_name_prefix='packer')
+            threading.Thread(target=self._collect, name='prompt-packer', daemon=True).start()
+            self.collector_pid = os.getpid()
+
+    def submit(self, model, sector, keywords, query_type):
+        """Queue one analysis, returns a Future of its result dict"""
+        self._ensure_collector()
+        future = Future()
+        self.pending.put((model, (sector, keywords, query_type), future))
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self.pending.get()]
+            window_ends = time.monotonic() + self.window
+            while len(batch) < self.max_items:
+                remaining = window_ends - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            groups = {}
+            for model, item, future in batch:
+                groups.setdefault(id(model), (model, []))[1].append((item, future))
+            for model, entries in groups.values():
+                self.executor.submit(self._dispatch, model, entries)
+
+    def _dispatch(self, model, entries):
+        """Run one (packed) Gemini call and resolve its futures"""
+        items = [item for item, future in entries]
+        packed = len(items) > 1
+        with self.lock:
+            self.items += len(items)
+            if packed:
+                self.packed_calls += 1
+            else:
+                self.single_calls += 1
+        
+        try:
+            gemini_breaker.check()
+            prompt = build_packed_prompt(items) if packed else build_analysis_prompt(*items[0])
+            with gemini_limiter.slot(), gemini_breaker.track():
+                started = time.perf_counter()
+                response = model.generate_content(prompt)
+                metrics.observe('agent_gemini_duration_seconds', (), time.perf_counter() - started)
+            parsed = extract_json(response.text)
+        except Exception as e:
+            for item, future in entries:
+                future.set_exception(e)
+            return
+        
+        if not packed:
+            entries[0][1].set_result(parsed)
+            return
+        for index, (item, future) in enumerate(entries):
+            entry = parsed.get(f"item_{index}") if isinstance(parsed, dict) else None
+            if isinstance(entry, dict):
+                future.set_result(entry)
+            else:
+                with self.lock:
+                    self.item_failures += 1
+                future.set_exception(json.JSONDecodeError(f"item_{index} missing from packed response", '', 0))
+
+    def get_stats(self):
+        """Get packing statistics"""
+        with self.lock:
+            calls = self.packed_calls + self.single_calls
+            return {
+                "enabled": GEMINI_PACKING,
+                "window_ms": self.window * 1000,
+                "max_items": self.max_items,
+                "calls": calls,
+                "packed_calls": self.packed_calls,
+                "items": self.items,
+                "avg_items_per_call": round(self.items / calls, 2) if calls else 0.0,
+                "item_failures": self.item_failures
+            }
+
+prompt_packer = PromptPacker(PACKING_WINDOW_MS / 1000, PACKING_MAX_ITEMS, GEMINI_MAX_CONCURRENCY)
+
+def packed_gemini_result(result, sector):
+    """Tag a raw analysis dict from the packer like parse_gemini_response does"""
+    result = dict(result)
+    result['sector'] = sector
+    result['analysis_source'] = "gemini"
+    return result
+
+def local_analysis(sector, keywords):
+    """Keyword analysis served by the router's local tier"""
+    result = fallback_analysis(sector, keywords)
+    result['model_tier'] = ModelRouter.LOCAL
+    return result
+
+def route_analysis(sector, keywords, query_type, deadline=None):
+    """Pick the model tier for an analysis, returns (tier, prompt, result)
+
+    result is already set when no Gemini call is needed (no model configured
+    or the local tier was chosen).
+    """
+    if not gemini_model:
+        logger.info("Gemini not available, using fallback analysis")
+        return None, None, fallback_analysis(sector, keywords)
+    
+    # Create analysis prompt and route it to a model tier
+    tier = model_router.select(query_type, keywords, deadline)
+    if tier.name == ModelRouter.LOCAL:
+        with tier.track():
+            return tier, None, local_analysis(sector, keywords)
+    return tier, build_analysis_prompt(sector, keywords, query_type), None
+
+def slot_deadline(deadline):
+    """How long a call may wait for a Gemini slot
+
+    Without background completion nobody collects a result after the
+    request deadline, so the wait ends there instead of running late.
+    """
+    return None if DEADLINE_BACKGROUND_COMPLETION else deadline
+
+@contextmanager
+def gemini_call():
+    """Circuit breaker bookkeeping and latency metric around one Gemini call"""
+    with gemini_breaker.track():
+        started = time.perf_counter()
+        yield
+        metrics.observe('agent_gemini_duration_seconds', (), time.perf_counter() - started)
+
+def gemini_success(result, tier, sector):
+    """Tag a parsed Gemini result with its tier and count it"""
+    result['model_tier'] = tier.name
+    metrics.inc('agent_gemini_requests_total', ('success',))
+    logger.info(f"Gemini analysis successful for {sector}")
+    return result
+
+def gemini_failure(error, sector, keywords):
+    """Map a failed Gemini analysis to a fallback result (or re-raise an overload under the reject policy)"""
+    if isinstance(error, GeminiCircuitOpen):
+        metrics.inc('agent_gemini_requests_total', ('circuit_open',))
+    elif isinstance(error, GeminiOverloaded):
+        metrics.inc('agent_gemini_requests_total', ('overloaded',))
+        if GEMINI_OVERLOAD_POLICY == 'reject':
+            raise error
+        logger.warning(f"Gemini overloaded, using fallback: {error}")
+    elif isinstance(error, json.JSONDecodeError):
+        metrics.inc('agent_gemini_requests_total', ('parse_error',))
+        logger.warning(f"JSON parse error from Gemini response: {error}")
+    else:
+        metrics.inc('agent_gemini_requests_total', ('error',))
+        logger.error(f"Gemini API error: {error}")
+    return fallback_analysis(sector, keywords)
+
+def analyze_with_gemini(sector, keywords, query_type="general", deadline=None):
+    """Use Gemini API for advanced trend analysis"""
+    tier, prompt, result = route_analysis(sector, keywords, query_type, deadline)
+    if result is not None:
+        return result
+    
+    try:
+        # Generate response
+        with tier.track():
+            if GEMINI_PACKING:
+                packed = prompt_packer.submit(tier.model, sector, keywords, query_type).result()
+                return gemini_success(packed_gemini_result(packed, sector), tier, sector)
+            gemini_breaker.check()
+            with gemini_limiter.slot(slot_deadline(deadline)), gemini_call():
+                response = tier.model.generate_content(prompt)
+        return gemini_success(parse_gemini_response(response.text, sector), tier, sector)
+    except Exception as e:
+        return gemini_failure(e, sector, keywords)
+
+def stream_gemini_analysis(sector, keywords, query_type):
+    """Stream a Gemini analysis, yields ('progress', chunk) and finally ('result', result)
+
+    The result is yielded as soon as the accumulated text parses, the rest of
+    the stream is drained afterwards.
+    """
+    tier, prompt, result = route_analysis(sector, keywords, query_type)
+    if result is not None:
+        yield 'result', result
+        return
+    
+    parts = []
+    try:
+        with tier.track():
+            gemini_breaker.check()
+            with gemini_limiter.slot(), gemini_call():
+                for chunk in tier.model.generate_content(prompt, stream=True):
+                    parts.append(chunk.text)
+                    yield 'progress', chunk.text
+                    
+                    if result is None and '}' in chunk.text:
+                        try:
+                            result = parse_gemini_response(''.join(parts), sector)
+                            result['model_tier'] = tier.name
+                            yield 'result', result
+                        except json.JSONDecodeError:
+                            pass  # Not complete yet
+        
+        if result is None:
+            result = parse_gemini_response(''.join(parts), sector)
+            result['model_tier'] = tier.name
+            yield 'result', result
+        metrics.inc('agent_gemini_requests_total', ('success',))
+        logger.info(f"Gemini streaming analysis successful for {sector}")
+        
+    except GeminiCircuitOpen:
+        metrics.inc('agent_gemini_requests_total', ('circuit_open',))
+        yield 'result', fallback_analysis(sector, keywords)
+    except GeminiOverloaded as e:
+        # The stream is already open, so overload always degrades to fallback
+        metrics.inc('agent_gemini_requests_total', ('overloaded',))
+        logger.warning(f"Gemini overloaded, using fallback: {e}")
+        yield 'result', fallback_analysis(sector, keywords)
+    except json.JSONDecodeError as e:
+        metrics.inc('agent_gemini_requests_total', ('parse_error',))
+        logger.warning(f"JSON parse error from Gemini stream: {e}")
+        yield 'result', fallback_analysis(sector, keywords)
+    except Exception as e:
+        metrics.inc('agent_gemini_requests_total', ('error',))
+        logger.error(f"Gemini API error: {e}")
+        if result is None:
+            yield 'result', fallback_analysis(sector, keywords)
+
+def cached_analysis(sector, keywords, query_type):
+    """Look up the result cache, returns (cache_key, (result, meta) on a hit else None)"""
+    cache_key = make_cache_key(sector, keywords, query_type)
+    cached_result = memory.result_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info(f"Cache hit for {sector} ({query_type})")
+        return cache_key, (cached_result, {"cached": True, "coalesced": False})
+    return cache_key, None
+
+def cache_analysis(cache_key, result):
+    """Cache a fresh analysis result and return it"""
+    # Only cache real AI results, fallback answers are cheap and should not
+    # hide Gemini coming back online
+    if result.get('analysis_source') == 'gemini':
+        memory.result_cache.put(cache_key, result)
+    return result
+
+def flight_result(sector, query_type, result, coalesced):
+    """(result, meta) for an analysis that went through analysis_flight"""
+    if coalesced:
+        logger.info(f"Coalesced with in-flight analysis for {sector} ({query_type})")
+    return dict(result), {"cached": False, "coalesced": coalesced}
+
+def run_analysis(sector, keywords, query_type, deadline=None, lookup=None):
+    """Analyze through the result cache, returns (result, meta)
+
+    lookup is the (cache_key, hit) of a cached_analysis() the caller already
+    made, so the cache counts one lookup per request.
+    """
+    cache_key, hit = lookup or cached_analysis(sector, keywords, query_type)
+    if hit is not None:
+        return hit
+
+    result, coalesced = analysis_flight.do(
+        cache_key, lambda: cache_analysis(cache_key, analyze_with_gemini(sector, keywords, query_type, deadline))
+    )
+    return flight_result(sector, query_type, result, coalesced)
+
+async def analyze_with_gemini_async(sector, keywords, query_type="general", deadline=None):
+    """Async variant of analyze_with_gemini - awaits Gemini without holding a thread"""
+    tier, prompt, result = route_analysis(sector, keywords, query_type, deadline)
+    if result is not None:
+        return result
+    
+    try:
+        model = tier.model
+        with tier.track():
+            if GEMINI_PACKING:
+                packed = await asyncio.wrap_future(prompt_packer.submit(model, sector, keywords, query_type))
+                return gemini_success(packed_gemini_result(packed, sector), tier, sector)
+            if isinstance(model, LazyGeminiModel):
+                # Configuring the SDK blocks, so the first load runs off the event loop
+                model = model.model or await asyncio.to_thread(model.load)
+            gemini_breaker.check()
+            async with gemini_limiter.slot_async(slot_deadline(deadline)):
+                with gemini_call():
+                    if hasattr(model, 'generate_content_async'):
+                        response = await model.generate_content_async(prompt)
+                    else:
+                        response = await asyncio.to_thread(model.generate_content, prompt)
+        return gemini_success(parse_gemini_response(response.text, sector), tier, sector)
+    except Exception as e:
+        return gemini_failure(e, sector, keywords)
+
+async def run_analysis_async(sector, keywords, query_type, deadline=None):
+    """Async variant of run_analysis, shares its cache and coalescing"""
+    cache_key, hit = cached_analysis(sector, keywords, query_type)
+    if hit is not None:
+        return hit
+
+    async def analyze_and_cache():
+        return cache_analysis(cache_key, await analyze_with_gemini_async(sector, keywords, query_type, deadline))
+
+    result, coalesced = await analysis_flight.do_async(cache_key, analyze_and_cache)
+    return flight_result(sector, query_type, result, coalesced)
+
+def degraded_fallback(sector, keywords):
+    """Fallback result marked as served because the deadline expired"""
+    result = fallback_analysis(sector, keywords)
+    result['degraded'] = True
+    result['degraded_reason'] = "deadline_exceeded"
+    return result
+
+def deadline_expired(task_id, sector, keywords, pending):
+    """(result, meta, pending) served when an analysis misses its deadline"""
+    logger.warning(f"Deadline exceeded, serving fallback - Task: {task_id}")
+    metrics.inc('agent_deadline_exceeded_total')
+    pending = pending if DEADLINE_BACKGROUND_COMPLETION else None
+    return degraded_fallback(sector, keywords), {"cached": False, "coalesced": False}, pending
+
+def finish_late_task(task_id, sector, future):
+    """Done-callback: replace a degraded task result with the late Gemini result"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result, meta = future.result()
+    memory.update_task(task_id, 'completed', result)
+    logger.info(f"Late analysis completed task {task_id} ({sector}, {result.get('analysis_source')})")
+
+def run_analysis_within(task_id, sector, keywords, query_type, deadline):
+    """run_analysis bounded by a time.monotonic() deadline
+
+    Returns (result, meta, pending). On expiry the result is a degraded
+    fallback and pending is the still-running analysis (or None).
+    """
+    if deadline is None or not gemini_model:
+        return (*run_analysis(sector, keywords, query_type), None)
+    lookup = cached_analysis(sector, keywords, query_type)
+    if lookup[1] is not None:
+        return (*lookup[1], None)
+    
+    if not deadline_slots.acquire(blocking=False):
+        # Raises under the reject policy, otherwise answers with the fallback
+        result = gemini_failure(gemini_limiter.reject("Gemini wait queue is full"), sector, keywords)
+        return result, {"cached": False, "coalesced": False}, None
+    try:
+        future = deadline_executor.submit(run_analysis, sector, keywords, query_type, deadline, lookup)
+    except BaseException:
+        deadline_slots.release()
+        raise
+    future.add_done_callback(lambda future: deadline_slots.release())
+    try:
+        return (*future.result(timeout=max(0.0, deadline - time.monotonic())), None)
+    except FutureTimeout:
+        return deadline_expired(task_id, sector, keywords, future)
+
+async def run_analysis_within_async(task_id, sector, keywords, query_type, deadline):
+    """Async variant of run_analysis_within"""
+    if deadline is None or not gemini_model:
+        return (*await run_analysis_async(sector, keywords, query_type), None)
+    
+    task = asyncio.ensure_future(run_analysis_async(sector, keywords, query_type, deadline))
+    try:
+        return (*await asyncio.wait_for(asyncio.shield(task), max(0.0, deadline - time.monotonic())), None)
+    except asyncio.TimeoutError:
+        return deadline_expired(task_id, sector, keywords, task)
+
+def analysis_task_failed(task_id, sector, keywords, error, fallback_on_error, reject_overload):
+    """Fallback (result, meta, pending) for a failed analysis task, or mark it failed and re-raise"""
+    if isinstance(error, GeminiOverloaded):
+        # Only a caller still holding the client connection can answer 429,
+        # queued and batch work degrades to fallback instead
+        if reject_overload:
+            memory.update_task(task_id, 'failed', {"error": str(error)})
+            raise error
+        logger.warning(f"Gemini overloaded, using fallback - Task: {task_id}")
+    elif not fallback_on_error:
+        logger.error(f"Analysis task failed - Task: {task_id}, Error: {error}")
+        memory.update_task(task_id, 'failed', {"error": str(error)})
+        raise error
+    else:
+        logger.warning(f"Analysis task error, using fallback - Task: {task_id}, Error: {error}")
+    return fallback_analysis(sector, keywords), {"cached": False, "coalesced": False}, None
+
+def complete_task(task_id, sector, query_type, analysis_result, pending=None):
+    """Mark a task completed and store it in short/long-term memory"""
+    # Update task status to completed
+    memory.update_task(task_id, 'completed', analysis_result)
+    metrics.inc('agent_analyses_total', (sector, analysis_result.get('analysis_source', 'unknown')))
+
+    # Store in memory
+    memory.add_short_term({
+        'task_id': task_id,
+        'sector': sector,
+        'type': query_type
+    })
+
+    memory.add_long_term({
+        'task_id': task_id,
+        'sector': sector,
+        'result': analysis_result
+    })
+
+    logger.info(f"Analysis completed - Task: {task_id}, Trend: {analysis_result.get('trend_direction')}")
+    if pending is not None:
+        # Registered after the update above so the late result always wins
+        pending.add_done_callback(lambda future: finish_late_task(task_id, sector, future))
+
+def process_analysis_task(task_id, sector, keywords, query_type, fallback_on_error=False,
+                          reject_overload=False, deadline=None):
+    """Run an analysis task and record the outcome in memory, returns (result, meta)"""
+    # Update task status to processing
+    memory.update_task(task_id, 'processing')
+    try:
+        analysis_result, meta, pending = run_analysis_within(task_id, sector, keywords, query_type, deadline)
+    except Exception as e:
+        analysis_result, meta, pending = analysis_task_failed(task_id, sector, keywords, e,
+                                                              fallback_on_error, reject_overload)
+    complete_task(task_id, sector, query_type, analysis_result, pending)
+    return analysis_result, meta
+
+async def process_analysis_task_async(task_id, sector, keywords, query_type, fallback_on_error=False,
+                                      reject_overload=False, deadline=None):
+    """Async variant of process_analysis_task"""
+    memory.update_task(task_id, 'processing')
+    try:
+        analysis_result, meta, pending = await run_analysis_within_async(task_id, sector, keywords,
+                                                                         query_type, deadline)
+    except Exception as e:
+        analysis_result, meta, pending = analysis_task_failed(task_id, sector, keywords, e,
+                                                              fallback_on_error, reject_overload)
+    complete_task(task_id, sector, query_type, analysis_result, pending)
+    return analysis_result, meta
+
+def validate_batch_items(items):
+    """Validate batch items up front, returns a list of error messages"""
+    if not isinstance(items, list) or not items:
+        return ["items must be a non-empty list"]
+    if len(items) > BATCH_MAX_ITEMS:
+        return [f"Too many items ({len(items)}), maximum is {BATCH_MAX_ITEMS}"]
+
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append(f"Item {index}: must be an object")
+        elif item.get('sector', 'Technology') not in AGENT_CONFIG["supported_sectors"]:
+            errors.append(f"Item {index}: unsupported sector '{item.get('sector')}'")
+        elif not isinstance(item.get('keywords', []), list):
+            errors.append(f"Item {index}: keywords must be a list")
+    return errors
+
+def wants_async(data, prefer_header=''):
+    """Check if the client asked for an asynchronous (202 Accepted) response"""
+    if str(data.get('mode', '')).lower() == 'async':
+        return True
+    return 'respond-async' in prefer_header.lower()
+
+# Request Handlers (shared by the Flask and ASGI apps)
+# Each handler returns (payload, status_code, headers)
+
+class JSONTemplate:
+    """JSON body serialized once, with only the named fields filled per render
+
+    The static part of the payload is encoded at startup and split around
+    placeholder values, so a render only serializes the dynamic fields.
+    """
+    def __init__(self, payload, dynamic):
+        placeholders = {name: f"@@{name}@@" for name in dynamic}
+        body = app.json.dumps({**payload, **placeholders}).encode('utf-8')
+        marks = sorted((body.index(app.json.dumps(mark).encode('utf-8')), name, mark)
+                       for name, mark in placeholders.items())
+        self.names = []
+        self.parts = []
+        start = 0
+        for position, name, mark in marks:
+            self.parts.append(body[start:position])
+            self.names.append(name)
+            start = position + len(app.json.dumps(mark).encode('utf-8'))
+        self.parts.append(body[start:])
+
+    def render(self, **values):
+        """Return the body as bytes with the dynamic fields filled in"""
+        chunks = [self.parts[0]]
+        for name, part in zip(self.names, self.parts[1:]):
+            chunks.append(app.json.dumps(values[name]).encode('utf-8'))
+            chunks.append(part)
+        return b''.join(chunks)
+
+HEALTH_TEMPLATE = JSONTemplate({
+    "status": "active",
+    "agent_id": AGENT_CONFIG["agent_id"],
+    "agent_name": AGENT_CONFIG["agent_name"],
+    "version": AGENT_CONFIG["version"]
+}, ("gemini_status", "timestamp"))
+
+INFO_STATS = {
+    "memory_stats": lambda: memory.get_stats(),
+    "worker_pool": lambda: worker_pool.get_stats(),
+    "request_coalescing": lambda: analysis_flight.get_stats(),
+    "gemini_limiter": lambda: gemini_limiter.get_stats(),
+    "gemini_breaker": lambda: gemini_breaker.get_stats(),
+    "model_router": lambda: model_router.get_stats(),
+    "prompt_packing": lambda: prompt_packer.get_stats(),
+    "webhooks": lambda: webhook_dispatcher.get_stats(),
+    "task_long_polling": lambda: task_watch.get_stats()
+}
+
+INFO_TEMPLATE = JSONTemplate({
+    "agent_id": AGENT_CONFIG["agent_id"],
+    "agent_name": AGENT_CONFIG["agent_name"],
+    "version": AGENT_CONFIG["version"],
+    "description": AGENT_CONFIG["description"],
+    "team": AGENT_CONFIG["team"],
+    "capabilities": AGENT_CONFIG["capabilities"],
+    "supported_sectors": AGENT_CONFIG["supported_sectors"],
+    "status": "ready",
+    "agent_type": AGENT_CONFIG["agent_type"],
+    "communication_protocol": AGENT_CONFIG["communication_protocol"],
+    "endpoints": AGENT_CONFIG["endpoints"],
+    "base_url": AGENT_CONFIG["base_url"]
+}, tuple(INFO_STATS) + ("timestamp",))
+
+LIVEZ_BODY = app.json.dumps({"status": "alive", "agent_id": AGENT_CONFIG["agent_id"]}).encode('utf-8')
+
+class InfoSnapshot:
+    """Rendered /info body and ETag, rebuilt at most every refresh_seconds
+
+    The ETag covers the stats only, so it stays the same while the agent is
+    idle; the timestamp in the body is when the stats last changed.
+    """
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.built_at = None
+        self.etag = None
+        self.body = None
+
+    def get(self):
+        """Return (body, etag), refreshing the snapshot when it is stale"""
+        with self.lock:
+            now = time.monotonic()
+            if self.built_at is None or now - self.built_at >= self.refresh_seconds:
+                stats = {name: read() for name, read in INFO_STATS.items()}
+                etag = '"' + hashlib.blake2b(app.json.dumps(stats).encode('utf-8'), digest_size=16).hexdigest() + '"'
+                if etag != self.etag:
+                    self.body = INFO_TEMPLATE.render(timestamp=datetime.now().isoformat(), **stats)
+                    self.etag = etag
+                self.built_at = now
+            return self.body, self.etag
+
+info_snapshot = InfoSnapshot(INFO_REFRESH_SECONDS)
+
+def health_response():
+    """Health check payload (pre-serialized)"""
+    return HEALTH_TEMPLATE.render(
+        gemini_status=gemini_status(),
+        timestamp=datetime.now().isoformat()
+    ), 200, {}
+
+def info_response(if_none_match=''):
+    """Agent information payload (pre-serialized), 304 when the ETag matches"""
+    body, etag = info_snapshot.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return b'', 304, headers
+    return body, 200, headers
+
+def livez_response():
+    """Liveness probe - the process is up and serving requests"""
+    return LIVEZ_BODY, 200, {}
+
+def readyz_response():
+    """Readiness probe - fails while work queues are full or Gemini is required but unavailable"""
+    pool = worker_pool.get_stats()
+    limiter = gemini_limiter.get_stats()
+    backend = gemini_status()
+    checks = {
+        "gemini": backend,
+        "worker_pool_saturated": pool["in_flight"] >= pool["workers"] + pool["queue_capacity"],
+        "gemini_queue_saturated": limiter["queue_capacity"] > 0 and limiter["queue_depth"] >= limiter["queue_capacity"],
+        "worker_pool_in_flight": pool["in_flight"],
+        "gemini_queue_depth": limiter["queue_depth"]
+    }
+    ready = not (checks["worker_pool_saturated"] or checks["gemini_queue_saturated"]
+                 or (READYZ_REQUIRE_GEMINI and backend not in ("connected", "simulated")))
+    return {
+        "status": "ready" if ready else "not_ready",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "checks": checks,
+        "timestamp": datetime.now().isoformat()
+    }, 200 if ready else 503, {}
+
+def register_response(data):
+    """Register a supervisor"""
+    if not isinstance(data, dict) or 'supervisor_id' not in data:
+        return {
+            "status": "error",
+            "message": "supervisor_id required",
+            "agent_id": AGENT_CONFIG["agent_id"]
+        }, 400, {}
+    
+    # Store supervisor information
+    memory.register_supervisor(data)
+    
+    logger.info(f"Supervisor registered: {data.get('supervisor_id')}")
+    
+    # Registration never depends on the callback URL; webhooks are only sent
+    # to URLs that pass check_webhook_url (again checked on every delivery)
+    supervisor_url = data.get('supervisor_url')
+    webhook_error = None
+    if not WEBHOOK_DELIVERY:
+        webhook_error = "webhook delivery is disabled"
+    elif not supervisor_url:
+        webhook_error = "no supervisor_url registered"
+    else:
+        try:
+            check_webhook_url(supervisor_url)
+        except (WebhookURLRejected, OSError) as e:
+            webhook_error = str(e)
+            logger.warning(f"Webhooks disabled for {data.get('supervisor_id')}: {e}")
+    
+    response = {
+        "status": "registered",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "agent_name": AGENT_CONFIG["agent_name"],
+        "capabilities": AGENT_CONFIG["capabilities"],
+        "supported_sectors": AGENT_CONFIG["supported_sectors"],
+        "message": "Agent registered successfully with supervisor",
+        "webhook_delivery": webhook_error is None,
+        "timestamp": datetime.now().isoformat()
+    }
+    if webhook_error:
+        response["webhook_error"] = webhook_error
+    return response, 200, {}
+
+def dead_letters_response():
+    """Webhook batches that could not be delivered"""
+    dead_letters = webhook_dispatcher.get_dead_letters()
+    return {
+        "status": "success",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "count": len(dead_letters),
+        "dead_letters": dead_letters,
+        "timestamp": datetime.now().isoformat()
+    }, 200, {}
+
+def task_status_response(task_id):
+    """Task status payload"""
+    task = memory.get_task(task_id)
+    
+    if not task and memory.is_task_expired(task_id):
+        return {
+            "status": "expired",
+            "message": "Task result expired and is no longer available",
+            "task_id": task_id,
+            "task_status": "expired",
+            "agent_id": AGENT_CONFIG["agent_id"]
+        }, 410, {}
+    
+    if not task:
+        return {
+            "status": "error",
+            "message": "Task not found",
+            "task_id": task_id,
+            "agent_id": AGENT_CONFIG["agent_id"]
+        }, 404, {}
+    
+    return {
+        "status": "success",
+        "task_id": task_id,
+        "task_status": task['status'],
+        "created_at": task['created_at'],
+        "updated_at": task['updated_at'],
+        "result": task.get('result'),
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "timestamp": datetime.now().isoformat()
+    }, 200, {}
+
+
+def parse_wait(value):
+    """Long-poll time from ?wait= or "wait", capped at TASK_WAIT_MAX, returns (seconds, error response)"""
+    if value in (None, ''):
+        return 0, None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        seconds = -1
+    if not math.isfinite(seconds) or seconds < 0:
+        return None, error_response("wait must be a non-negative number of seconds", 400)
+    return min(seconds, TASK_WAIT_MAX), None
+
+def prepare_status_lookup(data):
+    """Validate a POST /tasks/status body
+
+    Returns ((task_ids, known_statuses, wait), None) or (None, error response)
+    """
+    task_ids = data.get('task_ids') if isinstance(data, dict) else None
+    if not isinstance(task_ids, list) or not task_ids or not all(isinstance(task_id, str) for task_id in task_ids):
+        return None, error_response("task_ids must be a non-empty list of task id strings", 400)
+    if len(task_ids) > TASK_STATUS_MAX_IDS:
+        return None, error_response(f"Too many task_ids ({len(task_ids)}), maximum is {TASK_STATUS_MAX_IDS}", 400)
+    
+    known = data.get('known_statuses') or {}
+    if not isinstance(known, dict):
+        return None, error_response("known_statuses must map task ids to statuses", 400)
+    wait, error = parse_wait(data.get('wait'))
+    if error:
+        return None, error
+    return (list(dict.fromkeys(task_ids)), dict(known), wait), None
+
+def bulk_status_response(task_ids, include_result=True):
+    """Status of several tasks in one payload"""
+    tasks = memory.get_tasks(task_ids)
+    statuses = {}
+    for task_id in task_ids:
+        task = tasks.get(task_id)
+        if task:
+            statuses[task_id] = {
+                "task_status": task['status'],
+                "created_at": task['created_at'],
+                "updated_at": task['updated_at']
+            }
+            if include_result:
+                statuses[task_id]["result"] = task.get('result')
+        else:
+            statuses[task_id] = {"task_status": "expired" if memory.is_task_expired(task_id) else "not_found"}
+    
+    return {
+        "status": "success",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "count": len(statuses),
+        "tasks": statuses,
+        "timestamp": datetime.now().isoformat()
+    }, 200, {}
+
+def error_response(message, status_code, **extra):
+    """Standard error payload"""
+    return {
+        "status": "error",
+        "message": message,
+        **extra,
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "timestamp": datetime.now().isoformat()
+    }, status_code, {}
+
+def prepare_analysis(data):
+    """Validate an /analyze request and register its task
+
+    Returns ((task_id, sector, keywords, query_type), None) or (None, error response)
+    """
+    if not data:
+        return None, error_response("No JSON data provided", 400)
+    if not isinstance(data, dict):
+        return None, error_response("Request body must be a JSON object", 400)
+    
+    # Extract parameters
+    sector = data.get('sector', 'Technology')
+    keywords = data.get('keywords', [])
+    query_type = data.get('type', 'general')
+    
+    # Validate sector
+    if sector not in AGENT_CONFIG["supported_sectors"]:
+        return None, error_response(
+            f"Unsupported sector. Supported: {', '.join(AGENT_CONFIG['supported_sectors'])}", 400
+        )
+    
+    # Generate task ID
+    task_id = str(uuid.uuid4())
+    
+    logger.info(f"Analysis request - Sector: {sector}, Type: {query_type}, Task: {task_id}")
+    
+    # Add task to queue (for supervisor tracking)
+    task_data = {
+        'sector': sector,
+        'keywords': keywords,
+        'type': query_type
+    }
+    if data.get('supervisor_id'):
+        task_data['supervisor_id'] = data['supervisor_id']  # Result is pushed to its registered URL
+    memory.add_task(task_id, task_data)
+    return (task_id, sector, keywords, query_type), None
+
+def parse_deadline(data, header_value=''):
+    """Request budget from X-Deadline-Ms or "deadline_ms", returns (monotonic deadline, error response)"""
+    raw = header_value or (data.get('deadline_ms') if isinstance(data, dict) else None)
+    if raw in (None, ''):
+        budget = REQUEST_DEADLINE
+    else:
+        try:
+            budget = float(raw) / 1000
+        except (TypeError, ValueError):
+            budget = -1
+        if budget <= 0:
+            return None, error_response("deadline_ms must be a positive number of milliseconds", 400)
+    
+    if budget <= 0:
+        return None, None  # No default deadline configured
+    return time.monotonic() + min(budget, REQUEST_DEADLINE_MAX), None
+
+def queue_analysis(task_id, sector, keywords, query_type):
+    """Hand a task to the worker pool, returns the 202 (or 503 when full) response"""
+    if not worker_pool.submit(process_analysis_task, task_id, sector, keywords, query_type):
+        memory.update_task(task_id, 'failed', {"error": "Analysis queue is full"})
+        logger.warning(f"Analysis queue full, rejected task: {task_id}")
+        payload, status_code, headers = error_response("Analysis queue is full, retry later", 503, task_id=task_id)
+        return payload, status_code, {'Retry-After': '1'}
+    
+    return {
+        "task_id": task_id,
+        "status": "accepted",
+        "task_status": "pending",
+        "status_url": f"/task/{task_id}",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "sector": sector,
+        "analysis_type": query_type,
+        "timestamp": datetime.now().isoformat()
+    }, 202, {'Location': f"/task/{task_id}", 'Preference-Applied': 'respond-async'}
+
+def overloaded_response(task_id, error):
+    """429 answer when Gemini has no free capacity"""
+    payload, status_code, headers = error_response(
+        "Gemini capacity exhausted, retry later", 429, task_id=task_id, retry_after=error.retry_after
+    )
+    return payload, status_code, {'Retry-After': str(error.retry_after)}
+
+def analysis_response(task_id, sector, query_type, analysis_result, meta):
+    """Successful analysis payload"""
+    return {
+        "task_id": task_id,
+        "status": "success",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "sector": sector,
+        "analysis_type": query_type,
+        "result": analysis_result,
+        **meta,
+        "timestamp": datetime.now().isoformat()
+    }, 200, {}
+
+def prepare_batch(data):
+    """Validate a batch request and register one task per item
+
+    Returns ([(task_id, sector, keywords, query_type), ...], None) or (None, error response)
+    """
+    if not data:
+        return None, error_response("No JSON data provided", 400)
+    if not isinstance(data, (dict, list)):
+        return None, error_response("Request body must be a JSON object or array", 400)
+    
+    # Accept either {"items": [...]} or a bare list
+    items = data if isinstance(data, list) else data.get('items')
+    
+    # Validate every item before doing any work
+    errors = validate_batch_items(items)
+    if errors:
+        return None, error_response(
+            "Invalid batch request", 400,
+            errors=errors, supported_sectors=AGENT_CONFIG["supported_sectors"]
+        )
+    
+    logger.info(f"Batch analysis request - Items: {len(items)}")
+    
+    tasks = []
+    supervisor_id = data.get('supervisor_id') if isinstance(data, dict) else None
+    for item in items:
         task_id = str(uuid.uuid4())
+        sector = item.get('sector', 'Technology')
+        keywords = item.get('keywords', [])
+        query_type = item.get('type', 'general')
         
-        logger.info(f"Analysis request - Sector: {sector}, Type: {query_type}, Task: {task_id}")
-        
-        # Add task to queue (for supervisor tracking)
-        memory.add_task(task_id, {
+        task_data = {
             'sector': sector,
             'keywords': keywords,
             'type': query_type
+        }
+        if item.get('supervisor_id', supervisor_id):
+            task_data['supervisor_id'] = item.get('supervisor_id', supervisor_id)
+        memory.add_task(task_id, task_data)
+        tasks.append((task_id, sector, keywords, query_type))
+    return tasks, None
+
+def batch_response(tasks, outcomes):
+    """Batch payload from tasks and their (result, meta) outcomes"""
+    results = []
+    for (task_id, sector, keywords, query_type), (analysis_result, meta) in zip(tasks, outcomes):
+        results.append({
+            "task_id": task_id,
+            "status": "success",
+            "sector": sector,
+            "analysis_type": query_type,
+            "result": analysis_result,
+            **meta
         })
+    
+    return {
+        "status": "success",
+        "agent_id": AGENT_CONFIG["agent_id"],
+        "batch_size": len(results),
+        "results": results,
+        "timestamp": datetime.now().isoformat()
+    }, 200, {}
+
+# Flask Routes
+
+def to_flask(response):
+    """Convert a handler response to a Flask response"""
+    payload, status_code, headers = response
+    if isinstance(payload, bytes):  # Pre-serialized body
+        return Response(payload, status=status_code, headers=headers, mimetype='application/json')
+    return jsonify(payload), status_code, headers
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('agent_requests_total', (route, request.method, str(response.status_code)))
+    metrics.observe('agent_request_duration_seconds', (route,), time.perf_counter() - g.request_started)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    logger.info("Health check requested", extra={'route': '/health'})
+    return to_flask(health_response())
+
+@app.route('/info', methods=['GET'])
+def agent_info():
+    """Return agent information"""
+    logger.info("Info requested", extra={'route': '/info'})
+    return to_flask(info_response(request.headers.get('If-None-Match', '')))
+
+@app.route('/livez', methods=['GET'])
+def liveness():
+    """Liveness probe endpoint"""
+    return to_flask(livez_response())
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    """Readiness probe endpoint"""
+    return to_flask(readyz_response())
+
+@app.route('/register', methods=['POST'])
+def register_with_supervisor():
+    """Allow supervisor to register with this agent"""
+    try:
+        return to_flask(register_response(request.get_json()))
+    except Exception as e:
+        logger.error(f"Registration error: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "agent_id": AGENT_CONFIG["agent_id"]
+        }), 500
+
+@app.route('/webhooks/dead-letters', methods=['GET'])
+def webhook_dead_letters():
+    """Undelivered supervisor webhooks"""
+    return to_flask(dead_letters_response())
+
+@app.route('/task/<task_id>', methods=['GET'])
+def get_task_status(task_id):
+    """Get status of a specific task, ?wait=<seconds> blocks until it changes"""
+    wait, error = parse_wait(request.args.get('wait'))
+    if error:
+        return to_flask(error)
+    if wait:
+        known = {task_id: request.args['status']} if request.args.get('status') else {}
+        task_watch.wait([task_id], known, wait)
+    return to_flask(task_status_response(task_id))
+
+@app.route('/tasks/status', methods=['POST'])
+def get_tasks_status():
+    """Get the status of many tasks in one call"""
+    data = request.get_json(silent=True)
+    params, error = prepare_status_lookup(data)
+    if error:
+        return to_flask(error)
+    task_ids, known, wait = params
+    if wait:
+        task_watch.wait(task_ids, known, wait)
+    return to_flask(bulk_status_response(task_ids, data.get('include_result', True)))
+
+@app.route('/analyze', methods=['POST'])
+def analyze_trends():
+    """Main analysis endpoint for business trend monitoring"""
+    
+    try:
+        # Parse request
+        data = request.get_json()
+        deadline, error = parse_deadline(data, request.headers.get('X-Deadline-Ms', ''))
+        if error:
+            return to_flask(error)
+        params, error = prepare_analysis(data)
+        if error:
+            return to_flask(error)
         
-        # Update task status to processing
-        memory.update_task(task_id, 'processing')
+        # Async mode - hand the task to the worker pool and answer right away
+        if wants_async(data, request.headers.get('Prefer', '')):
+            return to_flask(queue_analysis(*params))
         
         # Perform analysis
-        analysis_result = analyze_with_gemini(sector, keywords, query_type)
+        task_id, sector, keywords, query_type = params
+        try:
+            analysis_result, meta = process_analysis_task(
+                task_id, sector, keywords, query_type, reject_overload=True, deadline=deadline
+            )
+        except GeminiOverloaded as e:
+            logger.warning(f"Gemini overloaded, rejected task: {task_id}")
+            return to_flask(overloaded_response(task_id, e))
+        return to_flask(analysis_response(task_id, sector, query_type, analysis_result, meta))
         
-        # Update task status to completed
-        memory.update_task(task_id, 'completed', analysis_result)
-        
-        # Store in memory
-        memory.add_short_term({
-            'task_id': task_id,
-            'sector': sector,
-            'type': query_type
-        })
+    except Exception as e:
+        logger.error(f"Analysis endpoint error: {str(e)}")
+        return to_flask(error_response(str(e), 500))
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze several sectors in one request, items run concurrently"""
+    
+    try:
+        data = request.get_json()
+        deadline, error = parse_deadline(data if isinstance(data, dict) else None, request.headers.get('X-Deadline-Ms', ''))
+        if error:
+            return to_flask(error)
+        tasks, error = prepare_batch(data)
+        if error:
+            return to_flask(error)
         
-        memory.add_long_term({
-            'task_id': task_id,
-            'sector': sector,
-            'result': analysis_result
-        })
+        # Fan out on the batch pool
+        futures = [
+            batch_executor.submit(process_analysis_task, task_id, sector, keywords, query_type, True, deadline=deadline)
+            for task_id, sector, keywords, query_type in tasks
+        ]
+        return to_flask(batch_response(tasks, [future.result() for future in futures]))
         
-        # Build response
-        response = {
+    except Exception as e:
+        logger.error(f"Batch analysis endpoint error: {str(e)}")
+        return to_flask(error_response(str(e), 500))
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {dumps_json(data).decode('utf-8')}\n\n"
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Streaming analysis endpoint - progress and result as Server-Sent Events"""
+    params, error = prepare_analysis(request.get_json(silent=True))
+    if error:
+        return to_flask(error)
+    task_id, sector, keywords, query_type = params
+    
+    def generate():
+        yield sse_event('accepted', {
             "task_id": task_id,
-            "status": "success",
             "agent_id": AGENT_CONFIG["agent_id"],
             "sector": sector,
             "analysis_type": query_type,
-            "result": analysis_result,
-            "timestamp": datetime.now().isoformat()
-        }
+            "status_url": f"/task/{task_id}"
+        })
+        memory.update_task(task_id, 'processing')
+        
+        cache_key, hit = cached_analysis(sector, keywords, query_type)
+        analysis_result = hit[0] if hit else None
+        
+        try:
+            if hit is None:
+                received = 0
+                for kind, payload in stream_gemini_analysis(sector, keywords, query_type):
+                    if kind == 'progress':
+                        received += len(payload)
+                        yield sse_event('progress', {"task_id": task_id, "received_chars": received, "delta": payload})
+                    elif analysis_result is None:
+                        analysis_result = payload
+                        yield sse_event('result', {"task_id": task_id, "cached": False, "result": analysis_result})
+                
+                cache_analysis(cache_key, analysis_result)
+            else:
+                yield sse_event('result', {"task_id": task_id, "cached": True, "result": analysis_result})
+            
+            complete_task(task_id, sector, query_type, analysis_result)
+            yield sse_event('done', {
+                "task_id": task_id,
+                "status": "success",
+                "task_status": "completed",
+                "timestamp": datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.error(f"Streaming analysis error - Task: {task_id}, Error: {e}")
+            memory.update_task(task_id, 'failed', {"error": str(e)})
+            yield sse_event('error', {"task_id": task_id, "status": "error", "message": str(e)})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
+    })
+
+# ASGI Application (asyncio serving mode)
+# Run with: uvicorn agent:asgi_app --host 0.0.0.0 --port 5000
+# Serves /health, /info, /livez, /readyz, /register, /task/<task_id>,
+# /tasks/status, /webhooks/dead-letters, /analyze and /analyze/batch with the
+# same handlers and memory as the Flask app, but awaits Gemini (and long-polls)
+# on the event loop. Streaming (/analyze/stream) is only served by the Flask app.
+
+ASGI_CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization, Prefer, X-Deadline-Ms')
+]
+
+async def asgi_send_json(send, response):
+    """Send a handler response as JSON"""
+    payload, status_code, headers = response
+    body = payload if isinstance(payload, bytes) else dumps_json(payload)
+    raw_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode())
+    ] + ASGI_CORS_HEADERS
+    raw_headers += [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def asgi_read_json(receive):
+    """Read the request body and decode it as JSON (None if empty or invalid)"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    try:
+        return loads_json(b''.join(chunks) or b'null')
+    except ValueError:
+        return None
+
+async def asgi_analyze(data, prefer_header, deadline_header=''):
+    """ASGI /analyze - same contract as the Flask route"""
+    try:
+        deadline, error = parse_deadline(data, deadline_header)
+        if error:
+            return error
+        params, error = prepare_analysis(data)
+        if error:
+            return error
+        
+        if wants_async(data, prefer_header):
+            return queue_analysis(*params)
         
-        logger.info(f"Analysis completed - Task: {task_id}, Trend: {analysis_result.get('trend_direction')}")
-        return jsonify(response), 200
+        task_id, sector, keywords, query_type = params
+        try:
+            analysis_result, meta = await process_analysis_task_async(
+                task_id, sector, keywords, query_type, reject_overload=True, deadline=deadline
+            )
+        except GeminiOverloaded as e:
+            logger.warning(f"Gemini overloaded, rejected task: {task_id}")
+            return overloaded_response(task_id, e)
+        return analysis_response(task_id, sector, query_type, analysis_result, meta)
         
     except Exception as e:
         logger.error(f"Analysis endpoint error: {str(e)}")
-        return jsonify({
-            "status": "error",
-            "message": str(e),
-            "agent_id": AGENT_CONFIG["agent_id"],
-            "timestamp": datetime.now().isoformat()
-        }), 500
+        return error_response(str(e), 500)
+
+async def asgi_analyze_batch(data, deadline_header=''):
+    """ASGI /analyze/batch - items run concurrently on the event loop"""
+    try:
+        deadline, error = parse_deadline(data if isinstance(data, dict) else None, deadline_header)
+        if error:
+            return error
+        tasks, error = prepare_batch(data)
+        if error:
+            return error
+        
+        outcomes = await asyncio.gather(*[
+            process_analysis_task_async(task_id, sector, keywords, query_type, True, deadline=deadline)
+            for task_id, sector, keywords, query_type in tasks
+        ])
+        return batch_response(tasks, outcomes)
+        
+    except Exception as e:
+        logger.error(f"Batch analysis endpoint error: {str(e)}")
+        return error_response(str(e), 500)
+
+async def asgi_task_status(task_id, query):
+    """ASGI /task/<task_id> - long-polls on the event loop"""
+    wait, error = parse_wait(query.get('wait', [''])[0])
+    if error:
+        return error
+    if wait:
+        known = {task_id: query['status'][0]} if query.get('status') else {}
+        await task_watch.wait_async([task_id], known, wait)
+    return task_status_response(task_id)
+
+async def asgi_tasks_status(data):
+    """ASGI /tasks/status - same contract as the Flask route"""
+    params, error = prepare_status_lookup(data)
+    if error:
+        return error
+    task_ids, known, wait = params
+    if wait:
+        await task_watch.wait_async(task_ids, known, wait)
+    return bulk_status_response(task_ids, data.get('include_result', True))
+
+async def asgi_app(scope, receive, send):
+    """Minimal ASGI app exposing the core agent endpoints"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                warm_up_gemini()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    
+    method = scope['method']
+    path = scope['path'].rstrip('/') or '/'
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    
+    if method == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 204, 'headers': ASGI_CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    
+    started = time.perf_counter()
+    route = '/task/<task_id>' if path.startswith('/task/') else path
+    if method == 'GET' and path == '/metrics':
+        body = metrics.render().encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')] + ASGI_CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': body})
+        metrics.inc('agent_requests_total', (route, method, '200'))
+        metrics.observe('agent_request_duration_seconds', (route,), time.perf_counter() - started)
+        return
+    elif method == 'GET' and path == '/health':
+        logger.info("Health check requested", extra={'route': '/health'})
+        response = health_response()
+    elif method == 'GET' and path == '/info':
+        logger.info("Info requested", extra={'route': '/info'})
+        response = info_response(headers.get('if-none-match', ''))
+    elif method == 'GET' and path == '/livez':
+        response = livez_response()
+    elif method == 'GET' and path == '/readyz':
+        response = readyz_response()
+    elif method == 'GET' and path == '/webhooks/dead-letters':
+        response = dead_letters_response()
+    elif method == 'GET' and path.startswith('/task/'):
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        response = await asgi_task_status(path[len('/task/'):], query)
+    elif method == 'POST' and path == '/tasks/status':
+        response = await asgi_tasks_status(await asgi_read_json(receive))
+    elif method == 'POST' and path == '/register':
+        response = await asyncio.to_thread(register_response, await asgi_read_json(receive))  # Resolves DNS
+    elif method == 'POST' and path == '/analyze':
+        response = await asgi_analyze(
+            await asgi_read_json(receive), headers.get('prefer', ''), headers.get('x-deadline-ms', '')
+        )
+    elif method == 'POST' and path == '/analyze/batch':
+        response = await asgi_analyze_batch(await asgi_read_json(receive), headers.get('x-deadline-ms', ''))
+    elif path in ('/health', '/info', '/livez', '/readyz', '/metrics', '/webhooks/dead-letters', '/tasks/status', '/register', '/analyze', '/analyze/batch') or path.startswith('/task/'):
+        response = error_response("Method not allowed", 405)
+    else:
+        route = 'unmatched'
+        response = error_response("Not found", 404)
+    
+    await asgi_send_json(send, response)
+    metrics.inc('agent_requests_total', (route, method, str(response[1])))
+    metrics.observe('agent_request_duration_seconds', (route,), time.perf_counter() - started)
+
+# Production Server (gunicorn)
+def serve_production(args):
+    """Run the agent under gunicorn with preloaded app and worker processes"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.error("gunicorn is not installed - run: pip install gunicorn")
+        sys.exit(1)
+    
+    class AgentServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', args.bind)
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('keepalive', args.keep_alive)
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('graceful_timeout', args.graceful_timeout)
+            self.cfg.set('max_requests', args.max_requests)
+            self.cfg.set('max_requests_jitter', args.max_requests // 10)
+            # The app is already loaded in this process, workers inherit it on
+            # fork instead of importing it again. The Gemini client is set up
+            # per worker on first use (or right after fork with GEMINI_WARMUP).
+            self.cfg.set('preload_app', True)
+            self.cfg.set('post_worker_init', lambda worker: warm_up_gemini())
+            if args.asgi:
+                self.cfg.set('worker_class', 'uvicorn.workers.UvicornWorker')
+            else:
+                self.cfg.set('worker_class', 'gthread')
+        
+        def load(self):
+            return asgi_app if args.asgi else app
+    
+    if args.workers > 1 and memory.storage is None:
+        logger.warning("Multiple workers with MEMORY_BACKEND=memory - each worker only sees its own tasks, "
+                       "set MEMORY_BACKEND=sqlite so /task/<task_id> works on every worker")
+    
+    task_watch.max_thread_waiters = default_thread_waiters(args.threads)
+    logger.info(f"Production server: {args.workers} worker(s) x {args.threads} thread(s) on {args.bind}"
+                f"{' (ASGI)' if args.asgi else ''}")
+    AgentServer().run()
+
+# Startup Profiling
+def import_time_breakdown(limit=15):
+    """Cumulative import time (ms) of the packages agent.py imports
+
+    Runs `python -X importtime -c "import agent"` in a fresh interpreter
+    and sums the direct imports of the agent module by top-level package.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import agent'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=120
+    )
+    totals = {}
+    pending = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == 'agent':
+                for module, micros in pending:
+                    package = module.split('.')[0]
+                    totals[package] = totals.get(package, 0) + micros
+            pending = []
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"package": package, "ms": round(micros / 1000, 1)} for package, micros in ranked]
+
+def profile_startup(args):
+    """Report startup phase timings, import costs and time to first request
+
+    Returns the process exit code: 1 when --profile-budget-ms is exceeded.
+    """
+    mark_startup('ready')
+    phases = []
+    previous = STARTUP_STARTED
+    for phase, ended in STARTUP_PHASES:
+        phases.append({"phase": phase, "ms": round((ended - previous) * 1000, 1)})
+        previous = ended
+    import_ms = (previous - STARTUP_STARTED) * 1000
+    
+    started = time.perf_counter()
+    with app.test_client() as client:
+        status_code = client.get('/health').status_code
+    first_request_ms = (time.perf_counter() - started) * 1000
+    
+    gemini_load_ms = None
+    if isinstance(gemini_model, LazyGeminiModel):
+        try:
+            gemini_model.load()
+            gemini_load_ms = round(gemini_model.load_seconds * 1000, 1)
+        except RuntimeError:
+            pass
+    
+    report = {
+        "module_import_ms": round(import_ms, 1),
+        "first_request_ms": round(first_request_ms, 1),
+        "first_request_status": status_code,
+        "time_to_first_request_ms": round(import_ms + first_request_ms, 1),
+        "gemini_load_ms": gemini_load_ms,
+        "phases": phases,
+        "packages": import_time_breakdown()
+    }
+    
+    print("Startup phases:")
+    for phase in report["phases"]:
+        print(f"  {phase['phase']:<16} {phase['ms']:>8.1f} ms")
+    print("Imports by package (cumulative):")
+    for package in report["packages"]:
+        print(f"  {package['package']:<16} {package['ms']:>8.1f} ms")
+    print(f"Module import:        {report['module_import_ms']:.1f} ms")
+    print(f"First /health:        {report['first_request_ms']:.1f} ms (HTTP {status_code})")
+    print(f"Time to first request: {report['time_to_first_request_ms']:.1f} ms")
+    print(f"Gemini client load:   {f'{gemini_load_ms:.1f} ms' if gemini_load_ms is not None else 'not configured'}")
+    
+    if args.profile_output:
+        with open(args.profile_output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.profile_output}")
+    if args.profile_budget_ms and report["time_to_first_request_ms"] > args.profile_budget_ms:
+        print(f"Time to first request exceeds budget of {args.profile_budget_ms:.0f} ms")
+        return 1
+    return 0
+
+def parse_args(argv=None):
+    """Command line: 'dev' (default, Flask dev server) or 'serve' (production)"""
+    parser = argparse.ArgumentParser(description=AGENT_CONFIG["agent_name"])
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print startup and import-time breakdown plus time to first request, then exit')
+    parser.add_argument('--profile-output', help='Also write the startup profile as JSON to this file')
+    parser.add_argument('--profile-budget-ms', type=float, default=0,
+                        help='Exit with status 1 if time to first request exceeds this (0 = no check)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('dev', help='Flask development server on $PORT or 5000 (default)')
+    
+    serve = subparsers.add_parser('serve', help='Production server (gunicorn)')
+    serve.add_argument('--bind', default=os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}"),
+                       help='Address to listen on (default: 0.0.0.0:$PORT)')
+    serve.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', '2')),
+                       help='Worker processes (default: $WEB_CONCURRENCY or 2)')
+    serve.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', '8')),
+                       help='Threads per worker (default: $WEB_THREADS or 8)')
+    serve.add_argument('--keep-alive', type=int, default=int(os.environ.get('WEB_KEEPALIVE', '5')),
+                       help='Seconds to hold idle keep-alive connections (default: 5)')
+    serve.add_argument('--timeout', type=int, default=int(os.environ.get('WEB_TIMEOUT', '60')),
+                       help='Seconds before a silent worker is restarted (default: 60)')
+    serve.add_argument('--graceful-timeout', type=int, default=30,
+                       help='Seconds to finish in-flight requests on restart (default: 30)')
+    serve.add_argument('--max-requests', type=int, default=int(os.environ.get('WEB_MAX_REQUESTS', '0')),
+                       help='Recycle a worker after this many requests, 0 = never (default: 0)')
+    serve.add_argument('--asgi', action='store_true',
+                       help='Serve agent.asgi_app with uvicorn workers instead of Flask')
+    return parser.parse_args(argv)
+
+mark_startup('routes')
 
 # Main entry point
 if __name__ == '__main__':
+    args = parse_args()
+    if args.profile_startup:
+        sys.exit(profile_startup(args))
+    
     logger.info("=" * 60)
     logger.info("MARKET TREND MONITOR AGENT - STARTING")
     logger.info("=" * 60)
@@ -481,9 +4305,21 @@ if __name__ == '__main__':
     logger.info("Endpoints:")
     logger.info("  GET  /health  - Health check")
     logger.info("  GET  /info    - Agent information")
+    logger.info("  GET  /livez   - Liveness probe")
+    logger.info("  GET  /readyz  - Readiness probe")
+    logger.info("  GET  /metrics - Prometheus metrics")
     logger.info("  POST /analyze - Market trend analysis")
+    logger.info("  POST /analyze/batch - Multi-sector analysis")
+    logger.info("  POST /analyze/stream - Streaming analysis (SSE)")
+    logger.info("  GET  /task/<id>?wait=<s> - Task status (long-poll)")
+    logger.info("  POST /tasks/status - Status of many tasks")
+    logger.info("  GET  /webhooks/dead-letters - Undelivered supervisor webhooks")
     logger.info("=" * 60)
     logger.info(f"Gemini API: {'Enabled' if gemini_model else 'Disabled (Fallback Mode)'}")
     logger.info("=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    if args.command == 'serve':
+        serve_production(args)
+    else:
+        warm_up_gemini()
+        app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '5000')), debug=False)
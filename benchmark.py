@@ -0,0 +1,352 @@
+"""
+Benchmark Suite
+Drives the Market Trend Monitor Agent under concurrent load and reports
+throughput and latency percentiles as JSON.
+
+Usage:
+    python benchmark.py                                   # fallback + simulated Gemini, in-process server
+    python benchmark.py --mode fallback --duration 5 --concurrency 16
+    python benchmark.py --scenarios health,mixed --mix analyze=6,task=3,health=1
+    python benchmark.py --save-baseline baseline.json     # record a baseline
+    python benchmark.py --baseline baseline.json --threshold 0.2   # exit 1 on regression
+    python benchmark.py --url http://localhost:5000 --mode remote  # against a running agent
+    python benchmark.py --micro                           # JSON serialization/extraction microbenchmarks
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import timeit
+
+import requests
+
+SECTORS = ["Technology", "E-commerce", "Healthcare", "Sustainability",
+           "Finance", "Education", "Manufacturing", "Retail"]
+KEYWORDS = ["AI", "cloud", "automation", "growth", "innovation", "digital",
+            "remote", "green", "legacy", "decline", "mobile", "fintech"]
+SCENARIOS = ["health", "analyze", "batch", "task", "mixed"]
+DEFAULT_MIX = "analyze=5,task=3,health=1,batch=1"
+
+# Request Generation
+def parse_mix(spec):
+    """Parse 'analyze=5,task=3' into [(operation, weight), ...]"""
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ("health", "analyze", "batch", "task"):
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+def analysis_payload(rng, repeat_ratio):
+    """Random sector/keywords; unique keywords defeat the result cache unless repeated"""
+    keywords = rng.sample(KEYWORDS, 3)
+    if rng.random() >= repeat_ratio:
+        keywords.append(f"bench{rng.getrandbits(48):x}")
+    return {"sector": rng.choice(SECTORS), "keywords": keywords, "type": "general"}
+
+def send(session, base_url, operation, rng, task_ids, args):
+    """Issue one request, returns the HTTP status (None when there is no task to look up)"""
+    if operation == "health":
+        response = session.get(f"{base_url}/health", timeout=args.timeout)
+    elif operation == "analyze":
+        response = session.post(f"{base_url}/analyze", json=analysis_payload(rng, args.repeat_ratio), timeout=args.timeout)
+        if response.status_code == 200:
+            task_ids.append(response.json()["task_id"])
+    elif operation == "batch":
+        items = [analysis_payload(rng, args.repeat_ratio) for _ in range(args.batch_size)]
+        response = session.post(f"{base_url}/analyze/batch", json={"items": items}, timeout=args.timeout)
+    elif not task_ids:
+        return None  # Every /analyze so far failed or was rejected
+    else:
+        response = session.get(f"{base_url}/task/{rng.choice(task_ids)}", timeout=args.timeout)
+    return response.status_code
+
+# Load Generation
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def run_scenario(base_url, scenario, task_ids, args):
+    """Run one scenario for args.duration seconds and summarize it"""
+    mix = parse_mix(args.mix) if scenario == "mixed" else [(scenario, 1.0)]
+    operations = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.warmup + args.duration
+    record_after = time.perf_counter() + args.warmup
+
+    def worker(index):
+        rng = random.Random(args.seed * 1000 + index)
+        session = requests.Session()
+        mine = []
+        failed = 0
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            operation = rng.choices(operations, weights)[0]
+            sent = True
+            try:
+                status = send(session, base_url, operation, rng, task_ids, args)
+                sent = status is not None
+                ok = sent and status < 400
+            except requests.RequestException:
+                ok = False
+            if started >= record_after:
+                if sent:  # A skipped task lookup has no latency to record
+                    mine.append(time.perf_counter() - started)
+                failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / args.duration, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+def seed_tasks(base_url, args):
+    """Create a few tasks so /task/<id> has something to look up"""
+    rng = random.Random(args.seed)
+    task_ids = []
+    session = requests.Session()
+    for _ in range(20):
+        try:
+            send(session, base_url, "analyze", rng, task_ids, args)
+        except requests.RequestException:
+            pass
+    if not task_ids:
+        print("No tasks could be seeded, task lookups are skipped and count as errors", file=sys.stderr)
+    return task_ids
+
+# In-process Server
+def start_agent(mode, args):
+    """Serve agent.app on a free local port, returns (base_url, server)"""
+    from werkzeug.serving import make_server
+    import agent
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log per request
+
+    # The router's fast tier reads agent.gemini_fast_model per call; clearing it
+    # sends every tier to the model below, never to an env-configured Gemini
+    agent.gemini_model = None
+    agent.gemini_fast_model = None
+    agent.GEMINI_PACKING = args.packing
+    if mode == "simulated":
+        agent.gemini_model = agent.SimulatedGeminiModel(
+            latency_ms=args.sim_latency_ms, jitter_ms=args.sim_jitter_ms,
+            latency_distribution=args.sim_distribution, error_rate=args.sim_error_rate,
+            malformed_rate=args.sim_malformed_rate, fenced_rate=args.sim_fenced_rate, seed=args.seed
+        )
+    agent.memory.result_cache.clear()
+
+    server = make_server("127.0.0.1", 0, agent.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+# Microbenchmarks
+ANALYSIS_RESULT = {
+    "trend_direction": "Rising",
+    "strength": "Strong",
+    "confidence": 0.87,
+    "key_patterns": ["AI adoption in underwriting", "Embedded finance", "Real-time payments"],
+    "insights": [
+        "Digital banking expanding across emerging markets",
+        "Fintech partnerships replacing in-house platforms",
+        "Regulators moving toward open banking standards"
+    ],
+    "recommendation": "Prioritize API partnerships with established fintech platforms",
+    "sector": "Finance",
+    "analysis_source": "gemini",
+    "model_tier": "fast"
+}
+MODEL_OUTPUTS = {
+    "unfenced": json.dumps(ANALYSIS_RESULT, indent=2),
+    "fenced": "```json\n" + json.dumps(ANALYSIS_RESULT, indent=2) + "\n```",
+    "surrounding_prose": "Here is the analysis you asked for:\n" + json.dumps(ANALYSIS_RESULT, indent=2) +
+                         "\n\nThese trends suggest the sector will keep growing over the next quarters.",
+}
+
+def legacy_extract(response_text):
+    """Fence handling used before the single-pass extractor"""
+    response_text = response_text.strip()
+    if '```json' in response_text:
+        response_text = response_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in response_text:
+        response_text = response_text.split('```')[1].split('```')[0].strip()
+    return json.loads(response_text)
+
+def time_per_op(fn, number):
+    """Best-of-5 microseconds per call"""
+    return round(min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6, 2)
+
+def run_micro(args):
+    """Time response serialization and model-output extraction"""
+    import agent
+
+    response = {
+        "task_id": "6f1c2b9e-8d0a-4c52-9a8e-1f7d3c2b4a61", "status": "success",
+        "agent_id": "market-trend-monitor-001", "sector": "Finance", "analysis_type": "general",
+        "result": ANALYSIS_RESULT, "cached": False, "coalesced": False,
+        "timestamp": "2026-01-01T12:00:00.000000"
+    }
+    batch = {"status": "success", "batch_size": 20, "results": [response] * 20}
+    body = json.dumps(response)
+    number = args.micro_iterations
+    results = {}
+    for name, payload in (("analyze_response", response), ("batch_response", batch)):
+        results[f"serialize/{name}/stdlib"] = time_per_op(lambda: json.dumps(payload, sort_keys=True), number)
+        results[f"serialize/{name}/provider"] = time_per_op(lambda: agent.app.json.dumps(payload), number)
+    results["parse_request/stdlib"] = time_per_op(lambda: json.loads(body), number)
+    results["parse_request/provider"] = time_per_op(lambda: agent.app.json.loads(body), number)
+    for name, text in MODEL_OUTPUTS.items():
+        if name != "surrounding_prose":  # legacy_extract raises on unfenced text with prose
+            results[f"extract/{name}/legacy"] = time_per_op(lambda: legacy_extract(text), number)
+        results[f"extract/{name}/extract_json"] = time_per_op(lambda: agent.extract_json(text), number)
+    
+    print(f"JSON backend: {'orjson' if agent.orjson else 'stdlib json'}", file=sys.stderr)
+    for name, micros in results.items():
+        print(f"  {name:45s} {micros:8.2f} us/op", file=sys.stderr)
+    return {name: {"us_per_op": micros} for name, micros in results.items()}
+
+# Baseline Comparison
+def find_regressions(results, baseline, threshold):
+    """Compare scenarios present in both runs, returns a list of messages"""
+    regressions = []
+    for name, current in results.get("micro", {}).items():
+        previous = baseline.get("micro", {}).get(name)
+        if previous and current["us_per_op"] > previous["us_per_op"] * (1 + threshold):
+            regressions.append(f"{name}: {current['us_per_op']}us/op vs baseline {previous['us_per_op']}us/op")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - threshold):
+            regressions.append(f"{name}: {current['rps']} req/s vs baseline {previous['rps']} req/s")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors vs baseline {previous['errors']}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Market Trend Monitor Agent")
+    parser.add_argument('--url', help='Benchmark a running agent instead of an in-process server')
+    parser.add_argument('--mode', choices=['fallback', 'simulated', 'both', 'remote'], default='both',
+                        help='Gemini mode for the in-process server (remote with --url)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Operation weights for the mixed scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='Measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Unmeasured seconds before each scenario')
+    parser.add_argument('--batch-size', type=int, default=5, help='Items per batch request')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0,
+                        help='Fraction of analyses reusing cacheable keywords')
+    parser.add_argument('--sim-latency-ms', type=float, default=200.0, help='Simulated Gemini mean latency')
+    parser.add_argument('--sim-jitter-ms', type=float, default=50.0, help='Simulated Gemini latency spread')
+    parser.add_argument('--sim-distribution', default='normal', help='fixed, uniform, normal or lognormal')
+    parser.add_argument('--sim-error-rate', type=float, default=0.0, help='Fraction of simulated Gemini errors')
+    parser.add_argument('--sim-malformed-rate', type=float, default=0.0, help='Fraction of unparseable responses')
+    parser.add_argument('--sim-fenced-rate', type=float, default=0.0, help='Fraction of markdown-fenced responses')
+    parser.add_argument('--packing', action='store_true', help='Pack concurrent Gemini calls (GEMINI_PACKING)')
+    parser.add_argument('--micro', action='store_true', help='Run JSON microbenchmarks instead of load scenarios')
+    parser.add_argument('--micro-iterations', type=int, default=2000, help='Calls per microbenchmark repeat')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout (seconds)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed regression fraction')
+    parser.add_argument('--save-baseline', help='Write results as a new baseline file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run the benchmark, returns the process exit code"""
+    args = parse_args(argv)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    if args.url:
+        modes = ['remote']
+    elif args.mode == 'both':
+        modes = ['fallback', 'simulated']
+    elif args.mode == 'remote':
+        print("--mode remote requires --url", file=sys.stderr)
+        return 2
+    else:
+        modes = [args.mode]
+
+    results = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline', 'save_baseline')},
+        "scenarios": {}
+    }
+    if args.micro:
+        results["micro"] = run_micro(args)
+        modes = []
+    for mode in modes:
+        server = None
+        base_url = args.url.rstrip('/') if args.url else None
+        if not base_url:
+            base_url, server = start_agent(mode, args)
+        task_ids = seed_tasks(base_url, args)
+        for scenario in scenarios:
+            name = f"{mode}/{scenario}"
+            print(f"Running {name} ({args.concurrency} clients, {args.duration}s)...", file=sys.stderr)
+            results["scenarios"][name] = summary = run_scenario(base_url, scenario, task_ids, args)
+            print(f"  {summary['rps']} req/s  p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  "
+                  f"p99 {summary['p99_ms']}ms  errors {summary['errors']}", file=sys.stderr)
+        if server:
+            server.shutdown()
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} of baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())